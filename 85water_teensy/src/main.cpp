@@ -1,14 +1,87 @@
 #include <Arduino.h>
 #include <Servo.h>
 
+// Legacy commands are two bytes: servo number then angle (0-199).
+// Trajectory frames start with FRAME_SYNC, which is never a servo number:
+//   SYNC, type, payload length, payload..., checksum (xor of type, length and payload)
+#define FRAME_SYNC 0xA5
+#define FRAME_SEGMENT 'S'
+#define FRAME_QUEUE 'Q'
+#define FRAME_TELEMETRY 'T'
+#define FRAME_START 'B'
+#define FRAME_CANCEL 'C'
+#define MAX_PAYLOAD 32
+
+#define NUM_SERVOS 5
+#define QUEUE_SIZE 16
+#define INTERP_PERIOD_US 1000
+#define ANGLE_SCALE 100.0f // segment angles/velocities are sent in hundredths
+#define TELEMETRY_PERIOD_US 50000
+#define START_EVENTS 16
+
 enum rx {
   servo_num,
-  command
+  command,
+  frame_type,
+  frame_len,
+  frame_payload,
+  frame_checksum
 };
 
 rx state;
 
 Servo s0, s1, s2, s3, s4;
+Servo *servos[NUM_SERVOS] = {&s0, &s1, &s2, &s3, &s4};
+
+// Cubic Hermite segment from the previous segment's end state to (pos, vel)
+struct segment {
+  uint8_t seq;
+  float duration;             // seconds
+  float pos[NUM_SERVOS];      // end angle (0-199)
+  float vel[NUM_SERVOS];      // end velocity (angle/s)
+};
+
+segment queue[QUEUE_SIZE];
+volatile uint8_t q_head = 0;  // next segment to run
+volatile uint8_t q_tail = 0;  // next free slot
+volatile uint8_t q_count = 0;
+
+// Interpolator state, owned by the timer interrupt
+volatile bool seg_active = false;
+float seg_t = 0;
+float start_pos[NUM_SERVOS];
+float start_vel[NUM_SERVOS];
+float cur_pos[NUM_SERVOS];
+float cur_vel[NUM_SERVOS];
+
+IntervalTimer interp_timer;
+
+uint8_t snum;
+uint8_t f_type;
+uint8_t f_len;
+uint8_t f_idx;
+uint8_t f_sum;
+uint8_t f_payload[MAX_PAYLOAD];
+uint8_t last_seq = 0;
+
+// Telemetry counters
+volatile uint16_t applied_us[NUM_SERVOS]; // last pulse width written to each servo
+volatile uint8_t active_seq = 0;          // sequence number of the running segment
+volatile uint16_t isr_max_us = 0;
+uint16_t parse_errors = 0;
+uint16_t dropped = 0;                     // segments rejected because the queue was full
+uint32_t segments_rx = 0;                 // valid segment frames, accepted or dropped
+uint32_t last_loop_us = 0;
+uint32_t last_telemetry_us = 0;
+uint32_t loop_max_us = 0;
+uint32_t loop_sum_us = 0;
+uint32_t loop_n = 0;
+
+// Segment start times, recorded by the interrupt and sent from loop()
+volatile uint8_t start_seq[START_EVENTS];
+volatile uint32_t start_us[START_EVENTS];
+volatile uint8_t start_head = 0;
+volatile uint8_t start_tail = 0;
 
 int remap(int angle) {
   int source_span = 199;
@@ -19,6 +92,231 @@ int remap(int angle) {
   return (int)(target_min + (angle-source_min) * scale_factor);
 }
 
+float remapf(float angle) {
+  return 1500.0f + angle * (400.0f / 199.0f);
+}
+
+void begin_segment() {
+  for(int i = 0; i < NUM_SERVOS; i++) {
+    start_pos[i] = cur_pos[i];
+    start_vel[i] = cur_vel[i];
+  }
+  seg_t = 0;
+  seg_active = true;
+  active_seq = queue[q_head].seq;
+  uint8_t next = (start_head + 1) % START_EVENTS;
+  if(next != start_tail) {
+    start_seq[start_head] = active_seq;
+    start_us[start_head] = micros();
+    start_head = next;
+  }
+}
+
+void write_servo(int i, float angle) {
+  int us = (int)remapf(angle);
+  applied_us[i] = us;
+  servos[i]->writeMicroseconds(us);
+}
+
+void run_interpolation() {
+  if(!seg_active) {
+    if(q_count == 0) {
+      return;
+    }
+    begin_segment();
+  }
+  segment &seg = queue[q_head];
+  seg_t += INTERP_PERIOD_US * 1e-6f;
+  if(seg_t >= seg.duration) {
+    for(int i = 0; i < NUM_SERVOS; i++) {
+      cur_pos[i] = seg.pos[i];
+      cur_vel[i] = seg.vel[i];
+      write_servo(i, cur_pos[i]);
+    }
+    q_head = (q_head + 1) % QUEUE_SIZE;
+    q_count--;
+    seg_active = false;
+    return;
+  }
+  float T = seg.duration;
+  float s = seg_t / T;
+  float s2 = s * s;
+  float s3 = s2 * s;
+  float h00 = 2*s3 - 3*s2 + 1;
+  float h10 = s3 - 2*s2 + s;
+  float h01 = -2*s3 + 3*s2;
+  float h11 = s3 - s2;
+  // Derivatives of the basis, divided by T to get angle/s
+  float d00 = (6*s2 - 6*s) / T;
+  float d10 = 3*s2 - 4*s + 1;
+  float d01 = (-6*s2 + 6*s) / T;
+  float d11 = 3*s2 - 2*s;
+  for(int i = 0; i < NUM_SERVOS; i++) {
+    cur_pos[i] = h00*start_pos[i] + h10*T*start_vel[i] + h01*seg.pos[i] + h11*T*seg.vel[i];
+    cur_vel[i] = d00*start_pos[i] + d10*start_vel[i] + d01*seg.pos[i] + d11*seg.vel[i];
+    write_servo(i, cur_pos[i]);
+  }
+}
+
+// Runs every INTERP_PERIOD_US
+void interpolate() {
+  uint32_t isr_start = micros();
+  run_interpolation();
+  uint32_t isr_time = micros() - isr_start;
+  if(isr_time > isr_max_us) {
+    isr_max_us = isr_time;
+  }
+}
+
+int16_t read_i16(const uint8_t *p) {
+  return (int16_t)(p[0] | (p[1] << 8));
+}
+
+void write_frame(uint8_t type, const uint8_t *payload, uint8_t len) {
+  uint8_t sum = type ^ len;
+  Serial1.write(FRAME_SYNC);
+  Serial1.write(type);
+  Serial1.write(len);
+  for(int i = 0; i < len; i++) {
+    Serial1.write(payload[i]);
+    sum ^= payload[i];
+  }
+  Serial1.write(sum);
+}
+
+void put_u16(uint8_t *p, uint16_t v) {
+  p[0] = v & 0xFF;
+  p[1] = v >> 8;
+}
+
+void put_u32(uint8_t *p, uint32_t v) {
+  put_u16(p, v & 0xFFFF);
+  put_u16(p + 2, v >> 16);
+}
+
+void send_queue_depth() {
+  uint8_t payload[3] = {q_count, QUEUE_SIZE, last_seq};
+  write_frame(FRAME_QUEUE, payload, sizeof(payload));
+}
+
+// Layout must match TELEMETRY_FORMAT in telemetry.py
+void send_telemetry(uint32_t now) {
+  uint8_t payload[31];
+  noInterrupts();
+  uint16_t isr_max = isr_max_us;
+  isr_max_us = 0;
+  uint16_t setpoints[NUM_SERVOS];
+  for(int i = 0; i < NUM_SERVOS; i++) {
+    setpoints[i] = applied_us[i];
+  }
+  uint8_t depth = q_count;
+  uint8_t seq = active_seq;
+  interrupts();
+
+  put_u32(&payload[0], now);
+  put_u16(&payload[4], loop_max_us > 0xFFFF ? 0xFFFF : loop_max_us);
+  put_u16(&payload[6], loop_n ? loop_sum_us / loop_n : 0);
+  put_u16(&payload[8], isr_max);
+  for(int i = 0; i < NUM_SERVOS; i++) {
+    put_u16(&payload[10 + 2*i], setpoints[i]);
+  }
+  payload[20] = depth;
+  payload[21] = seq;
+  payload[22] = last_seq;
+  put_u16(&payload[23], parse_errors);
+  put_u16(&payload[25], dropped);
+  put_u32(&payload[27], segments_rx);
+  write_frame(FRAME_TELEMETRY, payload, sizeof(payload));
+
+  loop_max_us = 0;
+  loop_sum_us = 0;
+  loop_n = 0;
+}
+
+// seq (u8), micros() when the segment started (u32)
+void send_start_events() {
+  while(start_tail != start_head) {
+    uint8_t payload[5];
+    payload[0] = start_seq[start_tail];
+    put_u32(&payload[1], start_us[start_tail]);
+    start_tail = (start_tail + 1) % START_EVENTS;
+    write_frame(FRAME_START, payload, sizeof(payload));
+  }
+}
+
+void handle_frame() {
+  switch(f_type) {
+    case FRAME_SEGMENT: {
+      // seq (u8), duration ms (u16), then end angle and velocity (i16) per servo
+      if(f_len != 3 + 4*NUM_SERVOS) {
+        parse_errors++;
+        break;
+      }
+      segments_rx++;
+      if(q_count >= QUEUE_SIZE) {
+        // Full: drop it, the depth report tells the host to back off
+        dropped++;
+        break;
+      }
+      segment &seg = queue[q_tail];
+      seg.seq = f_payload[0];
+      seg.duration = (f_payload[1] | (f_payload[2] << 8)) * 1e-3f;
+      for(int i = 0; i < NUM_SERVOS; i++) {
+        seg.pos[i] = read_i16(&f_payload[3 + 4*i]) / ANGLE_SCALE;
+        seg.vel[i] = read_i16(&f_payload[5 + 4*i]) / ANGLE_SCALE;
+      }
+      if(seg.duration <= 0) {
+        seg.duration = INTERP_PERIOD_US * 1e-6f;
+      }
+      last_seq = seg.seq;
+      noInterrupts();
+      q_tail = (q_tail + 1) % QUEUE_SIZE;
+      q_count++;
+      interrupts();
+      break;
+    }
+    case FRAME_CANCEL: {
+      // seq (u8), stop time ms (u16): drop every queued segment and ease to
+      // a stop from the current position and velocity
+      if(f_len != 3) {
+        parse_errors++;
+        break;
+      }
+      float T = (f_payload[1] | (f_payload[2] << 8)) * 1e-3f;
+      noInterrupts();
+      q_head = 0;
+      q_tail = 0;
+      q_count = 0;
+      seg_active = false;
+      if(T > 0) {
+        // Constant deceleration covers half the distance at the current speed
+        segment &seg = queue[0];
+        seg.seq = f_payload[0];
+        seg.duration = T;
+        for(int i = 0; i < NUM_SERVOS; i++) {
+          seg.pos[i] = constrain(cur_pos[i] + cur_vel[i] * T / 2, 0.0f, 199.0f);
+          seg.vel[i] = 0;
+        }
+        q_tail = 1;
+        q_count = 1;
+        last_seq = seg.seq;
+      } else {
+        for(int i = 0; i < NUM_SERVOS; i++) {
+          cur_vel[i] = 0;
+        }
+      }
+      interrupts();
+      break;
+    }
+    case FRAME_QUEUE:
+      // Depth request, answered below
+      break;
+    default:
+      break;
+  }
+  send_queue_depth();
+}
+
 void setup() {
   Serial1.begin(115200);
   state = servo_num;
@@ -27,21 +325,56 @@ void setup() {
   s2.attach(37, 1500, 1900);
   s3.attach(36, 1500, 1900);
   s4.attach(33, 1500, 1900);
+  // Servo.attach leaves every servo at 1500us, i.e. angle 0; report that
+  // so the host knows where the first trajectory starts
+  for(int i = 0; i < NUM_SERVOS; i++) {
+    cur_pos[i] = 0;
+    cur_vel[i] = 0;
+    applied_us[i] = (uint16_t)remapf(cur_pos[i]);
+  }
+  last_loop_us = micros();
+  last_telemetry_us = last_loop_us;
+  interp_timer.begin(interpolate, INTERP_PERIOD_US);
   }
 
 void loop() {
+  uint32_t now = micros();
+  uint32_t loop_us = now - last_loop_us;
+  last_loop_us = now;
+  if(loop_us > loop_max_us) {
+    loop_max_us = loop_us;
+  }
+  loop_sum_us += loop_us;
+  loop_n++;
+  if(now - last_telemetry_us >= TELEMETRY_PERIOD_US) {
+    last_telemetry_us = now;
+    send_telemetry(now);
+  }
+  send_start_events();
+
   int x = Serial1.read();
-  int snum = -1;
   int cmd = -1;
   if(x!=-1) {
     switch(state) {
       case servo_num:
+        if(x == FRAME_SYNC) {
+          state = frame_type;
+          break;
+        }
         snum = x;
         state = command;
         break;
       case command:
         cmd = remap(x);
         Serial.printf("commanding %i microseconds\n", cmd);
+        if(snum < NUM_SERVOS) {
+          // Later segments start from where this command left the servo
+          noInterrupts();
+          cur_pos[snum] = x;
+          cur_vel[snum] = 0;
+          applied_us[snum] = cmd;
+          interrupts();
+        }
         switch(snum) {
           case 0:
             s0.writeMicroseconds(cmd);
@@ -59,10 +392,45 @@ void loop() {
             s4.writeMicroseconds(cmd);
             break;
           default:
+            break;
+        }
+        state = servo_num;
+        break;
+      case frame_type:
+        f_type = x;
+        f_sum = x;
+        state = frame_len;
+        break;
+      case frame_len:
+        f_len = x;
+        f_sum ^= x;
+        f_idx = 0;
+        if(f_len > MAX_PAYLOAD) {
+          parse_errors++;
+          state = servo_num;
+        } else if(f_len == 0) {
+          state = frame_checksum;
+        } else {
+          state = frame_payload;
+        }
+        break;
+      case frame_payload:
+        f_payload[f_idx++] = x;
+        f_sum ^= x;
+        if(f_idx >= f_len) {
+          state = frame_checksum;
+        }
+        break;
+      case frame_checksum:
+        if(x == f_sum) {
+          handle_frame();
+        } else {
+          parse_errors++;
         }
         state = servo_num;
         break;
       default:
+        break;
     }
   }
-}
\ No newline at end of file
+}
@@ -1,6 +1,11 @@
+import json
 import numpy as np
 from typing import Tuple, Optional, Dict
 
+JOINTS = ('joint1', 'joint2', 'joint3', 'joint4')
+# IK branches as (base flipped, elbow up)
+BRANCHES = ((False, True), (False, False), (True, True), (True, False))
+
 class RobotArmIK:
     def __init__(self):
         """Initialize robot arm with segment lengths in mm"""
@@ -18,6 +23,19 @@ class RobotArmIK:
             'joint4': {'offset': 90.0, 'direction': 1}    # Wrist
         }
         
+        # Servo command range (degrees) accepted by the firmware's remap
+        self.servo_limits = {
+            'joint1': (0.0, 199.0),
+            'joint2': (0.0, 199.0),
+            'joint3': (0.0, 199.0),
+            'joint4': (0.0, 199.0)
+        }
+        
+        # Arm base in the table frame of the detect_color positions (mm),
+        # and the angle of the arm's x axis in that frame (degrees)
+        self.base_position = (0.0, 0.0)
+        self.base_angle = 0.0
+        
     def set_servo_calibration(self, joint_name: str, offset: float, direction: int):
         """
         Set calibration parameters for a specific joint.
@@ -40,6 +58,61 @@ class RobotArmIK:
         else:
             raise ValueError(f"Unknown joint: {joint_name}")
     
+    def load_config(self, path: str = 'params.json'):
+        """
+        Load link lengths and servo calibration from a params file.
+        
+        params.json numbers the lengths from the base up: L1 is the shoulder
+        height, L2/L3 the arm links and L4 the grabber. 'base' places the
+        arm on the table (see table_to_arm).
+        """
+        with open(path) as f:
+            params = json.load(f)
+        self.h_base = params.get('L1', self.h_base)
+        self.L1 = params.get('L2', self.L1)
+        self.L2 = params.get('L3', self.L2)
+        self.L3 = params.get('L4', self.L3)
+        for joint_name, config in params.get('servo_config', {}).items():
+            self.set_servo_calibration(joint_name, config['offset'], config['direction'])
+        base = params.get('base', {})
+        self.base_position = (base.get('x', self.base_position[0]), base.get('y', self.base_position[1]))
+        self.base_angle = base.get('angle', self.base_angle)
+    
+    def save_config(self, path: str = 'params.json'):
+        """Write link lengths and servo calibration back to a params file"""
+        try:
+            with open(path) as f:
+                params = json.load(f)
+        except FileNotFoundError:
+            params = {}
+        params['L1'] = float(self.h_base)
+        params['L2'] = float(self.L1)
+        params['L3'] = float(self.L2)
+        params['L4'] = float(self.L3)
+        params['servo_config'] = {
+            joint: {'offset': float(config['offset']), 'direction': int(config['direction'])}
+            for joint, config in self.servo_config.items()
+        }
+        params['base'] = {'x': float(self.base_position[0]), 'y': float(self.base_position[1]),
+                          'angle': float(self.base_angle)}
+        with open(path, 'w') as f:
+            json.dump(params, f, indent=4)
+    
+    def table_to_arm(self, x: float, y: float) -> Tuple[float, float]:
+        """
+        Convert a table position (e.g. a detected box) to the arm frame the
+        IK works in.
+        
+        Args:
+            x, y: Position in the detect_color table frame (mm)
+            
+        Returns:
+            (x, y) relative to the arm base (mm)
+        """
+        dx, dy = x - self.base_position[0], y - self.base_position[1]
+        c, s = np.cos(np.radians(self.base_angle)), np.sin(np.radians(self.base_angle))
+        return (float(c * dx + s * dy), float(-s * dx + c * dy))
+    
     def world_to_servo_angle(self, world_angle: float, joint_name: str) -> float:
         """
         Convert world-space angle to servo command angle.
@@ -150,6 +223,174 @@ class RobotArmIK:
             'servo_angles': servo_angles
         }
     
+    def _ik_branches(self, x: float, y: float, z: float, grabber_angles_deg) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Evaluate every analytic IK branch for a set of grabber angles at once.
+        
+        Branches are elbow up/down, each with the base pointing at the target
+        or flipped by 180° with the shoulder reaching backwards.
+        
+        Args:
+            x, y, z: Target position (mm)
+            grabber_angles_deg: Array of shape (P,) of grabber angles to try
+            
+        Returns:
+            Tuple of (world_angles, reachable): world angles in degrees with
+            shape (P, 4, 4) indexed [pitch, branch, joint], and a boolean
+            array of shape (P, 4) marking the reachable solutions.
+            Branch order is BRANCHES.
+        """
+        grabber_angle = np.deg2rad(np.atleast_1d(np.asarray(grabber_angles_deg, dtype=float)))[:, None]
+        
+        flipped = np.array([b[0] for b in BRANCHES])
+        elbow = np.array([1.0 if b[1] else -1.0 for b in BRANCHES])
+        
+        # Flipping the base mirrors the vertical plane: the target is behind
+        # the shoulder and the grabber angle is measured from the other side
+        r_target = np.sqrt(x**2 + y**2) * np.where(flipped, -1.0, 1.0)
+        plane_angle = np.where(flipped, np.pi - grabber_angle, grabber_angle)
+        theta1 = np.arctan2(y, x) + np.where(flipped, np.pi, 0.0)
+        
+        r_wrist = r_target - self.L3 * np.cos(plane_angle)
+        z_from_shoulder = z - self.L3 * np.sin(plane_angle) - self.h_base
+        d = np.sqrt(r_wrist**2 + z_from_shoulder**2)
+        reachable = (d <= self.L1 + self.L2) & (d >= abs(self.L1 - self.L2))
+        
+        cos_theta3 = np.clip((d**2 - self.L1**2 - self.L2**2) / (2 * self.L1 * self.L2), -1.0, 1.0)
+        theta3 = elbow * np.arccos(cos_theta3)
+        alpha = np.arctan2(z_from_shoulder, r_wrist)
+        beta = np.arctan2(self.L2 * np.sin(theta3), self.L1 + self.L2 * np.cos(theta3))
+        theta2 = alpha - beta
+        theta4 = plane_angle - theta2 - theta3
+        
+        world = np.stack(np.broadcast_arrays(theta1, theta2, theta3, theta4), axis=-1)
+        # Wrap to [-180, 180)
+        world = (np.rad2deg(world) + 180.0) % 360.0 - 180.0
+        return world, reachable
+    
+    def _servo_candidates(self, world: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Convert IK candidates to servo angles, choosing the 360° turn of each
+        joint that lands inside its servo range.
+        
+        Returns:
+            Tuple of (servo_angles, world_angles, within_limits)
+        """
+        limits = np.array([self.servo_limits[j] for j in JOINTS])
+        servo = self.world_to_servo_angles(world)
+        servo = limits[:, 0] + (servo - limits[:, 0]) % 360.0
+        return servo, self.servo_to_world_angles(servo), self.within_servo_limits(servo)
+    
+    @staticmethod
+    def _motion_cost(servo: np.ndarray, current: Optional[Dict]) -> np.ndarray:
+        """
+        Cost of moving from the current servo angles to each candidate: the
+        largest joint move (servos move together, so it sets the move time)
+        with the total move as a tie breaker.
+        """
+        if current is None:
+            return np.zeros(servo.shape[:-1])
+        delta = np.abs(servo - np.array([current[j] for j in JOINTS]))
+        return np.max(delta, axis=-1) + 0.01 * np.sum(delta, axis=-1)
+    
+    def _solution(self, world: np.ndarray, servo: np.ndarray) -> Dict:
+        return {
+            'world_angles': {j: float(a) for j, a in zip(JOINTS, world)},
+            'servo_angles': {j: float(a) for j, a in zip(JOINTS, servo)}
+        }
+    
+    def inverse_kinematics_nearest(self,
+                                   x: float,
+                                   y: float,
+                                   z: float,
+                                   current_servo_angles: Optional[Dict] = None,
+                                   grabber_angle_deg: float = -90.0) -> Optional[Dict]:
+        """
+        Calculate inverse kinematics choosing the branch automatically.
+        
+        All branches (elbow up/down, base flipped) are evaluated, the ones
+        outside servo_limits are discarded and the one needing the smallest
+        joint move from current_servo_angles is returned.
+        
+        Args:
+            x: Target x position (mm)
+            y: Target y position (mm)
+            z: Target z position (mm)
+            current_servo_angles: Current servo angles ('joint1', ...); if None,
+                                  the first valid branch in BRANCHES order is used
+            grabber_angle_deg: Desired angle of grabber relative to horizontal (degrees)
+            
+        Returns:
+            Dictionary with 'world_angles', 'servo_angles' and 'branch'
+            (flipped, elbow_up), or None if no branch is valid
+        """
+        world, reachable = self._ik_branches(x, y, z, [grabber_angle_deg])
+        servo, world, within = self._servo_candidates(world[0])
+        valid = reachable[0] & within
+        if not np.any(valid):
+            print(f"Target unreachable within servo limits: ({x:.2f}, {y:.2f}, {z:.2f})")
+            return None
+        
+        cost = np.where(valid, self._motion_cost(servo, current_servo_angles), np.inf)
+        best = int(np.argmin(cost))
+        result = self._solution(world[best], servo[best])
+        result['branch'] = BRANCHES[best]
+        return result
+    
+    def inverse_kinematics_relaxed(self,
+                                   x: float,
+                                   y: float,
+                                   z: float,
+                                   grabber_angle_deg: float = -90.0,
+                                   max_deviation_deg: float = 45.0,
+                                   step_deg: float = 1.0,
+                                   current_servo_angles: Optional[Dict] = None) -> Optional[Dict]:
+        """
+        Calculate inverse kinematics, relaxing the grabber angle if needed.
+        
+        Candidate grabber angles within max_deviation_deg of the requested
+        one are evaluated together over all branches; the valid solution with
+        the grabber angle closest to the requested one wins, ties going to the
+        smallest joint move from current_servo_angles.
+        
+        Args:
+            x: Target x position (mm)
+            y: Target y position (mm)
+            z: Target z position (mm)
+            grabber_angle_deg: Preferred angle of grabber relative to horizontal (degrees)
+            max_deviation_deg: Largest change of grabber angle allowed (degrees)
+            step_deg: Spacing of the candidate grabber angles (degrees)
+            current_servo_angles: Current servo angles ('joint1', ...), or None
+            
+        Returns:
+            Dictionary with 'world_angles', 'servo_angles', 'branch' and
+            'grabber_angle_deg' (the angle actually used), or None if unreachable
+        """
+        steps = int(np.floor(max_deviation_deg / step_deg))
+        deviation = np.arange(-steps, steps + 1) * step_deg
+        # Order candidates by how far they are from the preferred angle
+        deviation = deviation[np.argsort(np.abs(deviation), kind='stable')]
+        pitches = grabber_angle_deg + deviation
+        
+        world, reachable = self._ik_branches(x, y, z, pitches)
+        servo, world, within = self._servo_candidates(world)
+        valid = reachable & within
+        if not np.any(valid):
+            print(f"Target unreachable: ({x:.2f}, {y:.2f}, {z:.2f}) within {max_deviation_deg:.0f}° of grabber angle {grabber_angle_deg:.0f}°")
+            return None
+        
+        # Closest pitch first, then smallest joint move
+        pitch_cost = np.broadcast_to(np.abs(deviation)[:, None], valid.shape)
+        best_pitch = np.min(pitch_cost[valid])
+        candidates = valid & (pitch_cost == best_pitch)
+        cost = np.where(candidates, self._motion_cost(servo, current_servo_angles), np.inf)
+        p, b = np.unravel_index(int(np.argmin(cost)), cost.shape)
+        
+        result = self._solution(world[p, b], servo[p, b])
+        result['branch'] = BRANCHES[b]
+        result['grabber_angle_deg'] = float(pitches[p])
+        return result
+    
     def forward_kinematics(self, angles: Dict, angle_type: str = 'world') -> Tuple[float, float, float]:
         """
         Calculate end effector position from joint angles.
@@ -197,6 +438,83 @@ class RobotArmIK:
         
         return (x, y, z)
     
+    def world_to_servo_angles(self, world_angles: np.ndarray) -> np.ndarray:
+        """
+        Vectorized world_to_servo_angle for a batch of configurations.
+        
+        Args:
+            world_angles: Array of shape (N, 4) with joint1..joint4 world angles in degrees
+            
+        Returns:
+            Array of shape (N, 4) with servo command angles
+        """
+        offsets = np.array([self.servo_config[j]['offset'] for j in JOINTS])
+        directions = np.array([self.servo_config[j]['direction'] for j in JOINTS])
+        return offsets + directions * np.asarray(world_angles, dtype=float)
+    
+    def servo_to_world_angles(self, servo_angles: np.ndarray) -> np.ndarray:
+        """
+        Vectorized servo_to_world_angle for a batch of configurations.
+        
+        Args:
+            servo_angles: Array of shape (N, 4) with servo command angles
+            
+        Returns:
+            Array of shape (N, 4) with world angles in degrees
+        """
+        offsets = np.array([self.servo_config[j]['offset'] for j in JOINTS])
+        directions = np.array([self.servo_config[j]['direction'] for j in JOINTS])
+        return (np.asarray(servo_angles, dtype=float) - offsets) / directions
+    
+    def within_servo_limits(self, servo_angles: np.ndarray) -> np.ndarray:
+        """
+        Check a batch of servo angles against servo_limits.
+        
+        Args:
+            servo_angles: Array of shape (N, 4)
+            
+        Returns:
+            Boolean array of shape (N,), True where every joint is in range
+        """
+        limits = np.array([self.servo_limits[j] for j in JOINTS])
+        servo_angles = np.asarray(servo_angles, dtype=float)
+        return np.all((servo_angles >= limits[:, 0]) & (servo_angles <= limits[:, 1]), axis=-1)
+    
+    def forward_kinematics_batch(self, world_angles: np.ndarray) -> np.ndarray:
+        """
+        Vectorized forward kinematics returning every joint position.
+        
+        Args:
+            world_angles: Array of shape (N, 4) with joint1..joint4 world angles in degrees
+            
+        Returns:
+            Array of shape (N, 4, 3) with the (x, y, z) positions of the
+            shoulder, elbow, wrist and grabber tip in mm
+        """
+        theta = np.deg2rad(np.asarray(world_angles, dtype=float).reshape(-1, 4))
+        theta1, theta2, theta3, theta4 = theta.T
+        
+        # Cumulative angles of each link in the vertical plane
+        a1 = theta2
+        a2 = theta2 + theta3
+        a3 = theta2 + theta3 + theta4
+        
+        r = np.zeros((theta.shape[0], 4))
+        z = np.full((theta.shape[0], 4), float(self.h_base))
+        r[:, 1] = self.L1 * np.cos(a1)
+        z[:, 1] += self.L1 * np.sin(a1)
+        r[:, 2] = r[:, 1] + self.L2 * np.cos(a2)
+        z[:, 2] = z[:, 1] + self.L2 * np.sin(a2)
+        r[:, 3] = r[:, 2] + self.L3 * np.cos(a3)
+        z[:, 3] = z[:, 2] + self.L3 * np.sin(a3)
+        
+        # Cylindrical to cartesian
+        points = np.empty((theta.shape[0], 4, 3))
+        points[:, :, 0] = r * np.cos(theta1)[:, None]
+        points[:, :, 1] = r * np.sin(theta1)[:, None]
+        points[:, :, 2] = z
+        return points
+    
     def calibrate_joint(self, joint_name: str):
         """
         Interactive calibration helper for a specific joint.
@@ -1,74 +1,179 @@
 import cv2
 from pupil_apriltags import Detector
 import numpy as np
+import json
+import os
 import sys
+from typing import Dict, Tuple
 
-def rectify_image_with_apriltag(image_path, tag_family='tag36h11', tag_size_pixels=60):
+def make_detector(tag_family='tag36h11'):
+    return Detector(
+            families=tag_family,
+            nthreads=1,
+            quad_decimate=1.0,
+            quad_sigma=0.0,
+            refine_edges=1,
+            decode_sharpening=0.25,
+            debug=0)
+
+BOARD_PATH = 'tag_board.json'
+
+class TagBoard:
+    def __init__(self, tags: Dict[int, Tuple[float, float]], tag_size: float = 60):
+        """
+        Set of AprilTags at known positions on the workspace.
+
+        All tags are assumed to be printed the same way up as the first one
+        (their corners in the same order as the rectified image axes).
+
+        :param tags: Tag ID -> (x, y) tag center in the rectified image (pixels).
+        :param tag_size: Tag side length in the rectified image (pixels).
+        """
+        self.tags = {int(k): (float(v[0]), float(v[1])) for k, v in tags.items()}
+        self.tag_size = tag_size
+
+    def corners(self, tag_id):
+        """
+        Corners of a tag in the rectified image, in detector corner order:
+        pupil_apriltags starts at the top-right corner of an upright tag and
+        goes top-left, bottom-left, bottom-right.
+        """
+        cx, cy = self.tags[tag_id]
+        half = self.tag_size / 2
+        return np.array([
+            [cx + half, cy - half],
+            [cx - half, cy - half],
+            [cx - half, cy + half],
+            [cx + half, cy + half]
+        ], dtype=np.float32)
+
+    @classmethod
+    def load(cls, path=BOARD_PATH):
+        """
+        Board from a JSON file like
+        {"tag_size": 60, "tags": {"0": [30, 30], "1": [610, 30], "2": [30, 450]}}
+
+        :return: TagBoard, or None if there is no file at path.
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['tags'], data.get('tag_size', 60))
+
+def fit_board_homography(results, board, ransac_threshold=3.0):
+    """
+    Fit one homography to the corners of every visible board tag with RANSAC.
+
+    :param results: pupil_apriltags detections.
+    :param board: TagBoard with the tag positions.
+    :param ransac_threshold: Largest reprojection error (pixels) of an inlier.
+    :return: Dictionary with 'H', 'tags' (IDs used), 'inliers' and 'points'
+        (corner counts), 'inlier_tags' (tags with all four corners inliers),
+        'inlier_ratio' and 'rms_error' (pixels, inliers only), or None if
+        fewer than 4 corners could be used.
+    """
+    seen = [r for r in results if r.tag_id in board.tags]
+    if not seen:
+        return None
+    src_points = np.concatenate([r.corners for r in seen]).astype(np.float32)
+    dst_points = np.concatenate([board.corners(r.tag_id) for r in seen])
+    H, mask = cv2.findHomography(src_points, dst_points, cv2.RANSAC, ransac_threshold)
+    if H is None:
+        return None
+    inliers = mask.ravel().astype(bool)
+    projected = cv2.perspectiveTransform(src_points[None], H)[0]
+    errors = np.linalg.norm(projected - dst_points, axis=1)
+    return {
+        'H': H,
+        'tags': [int(r.tag_id) for r in seen],
+        'inliers': int(inliers.sum()),
+        'points': len(src_points),
+        'inlier_tags': int(inliers.reshape(-1, 4).all(axis=1).sum()),
+        'inlier_ratio': float(inliers.mean()),
+        'rms_error': float(np.sqrt(np.mean(errors[inliers] ** 2))) if inliers.any() else float('inf')
+    }
+
+def estimate_homography(image, detector, board=None, tag_size_pixels=60, ransac_threshold=3.0):
+    """
+    Homography mapping the image to the top-down view of the board.
+
+    Without a board the first detected tag is mapped to a tag_size_pixels
+    square in the top-left corner.
+
+    :param image: BGR image.
+    :param detector: pupil_apriltags Detector (see make_detector).
+    :param board: TagBoard, or None for a single tag.
+    :param tag_size_pixels: The desired size of the tag in the rectified image
+        (single tag only).
+    :return: fit_board_homography result, or None if no tag was found.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    results = detector.detect(gray)
+    if not results:
+        return None
+    if board is None:
+        half_size = tag_size_pixels // 2
+        board = TagBoard({results[0].tag_id: (half_size, half_size)}, tag_size_pixels)
+    return fit_board_homography(results, board, ransac_threshold)
+
+def find_homography(image, detector, tag_size_pixels=60, board=None):
+    """
+    Homography mapping the image to the top-down view (see estimate_homography).
+
+    :return: 3x3 homography, or None if no tag was found.
+    """
+    fit = estimate_homography(image, detector, board, tag_size_pixels)
+    return None if fit is None else fit['H']
+
+def rectify(image, detector, tag_size_pixels=60, board=None):
     """
-    Rectifies an image based on a detected AprilTag, effectively creating a 
+    In-memory version of rectify_image_with_apriltag without any display.
+
+    :return: Rectified image, or None if no homography could be found.
+    """
+    H = find_homography(image, detector, tag_size_pixels, board)
+    if H is None:
+        return None
+    return cv2.warpPerspective(image, H, (image.shape[1], image.shape[0]))
+
+def rectify_image_with_apriltag(image_path, tag_family='tag36h11', tag_size_pixels=60, board=None):
+    """
+    Rectifies an image based on the detected AprilTags, effectively creating a 
     top-down view of the tag and its immediate surroundings.
 
     :param image_path: Path to the input image.
     :param tag_family: The AprilTag family to detect (e.g., 'tag36h11').
     :param tag_size_pixels: The desired size of the tag in the rectified image.
+    :param board: TagBoard to use, defaults to the one in tag_board.json. With
+        no board the first detected tag is used.
     """
-    # 1. Load Image and Detect AprilTag
+    # 1. Load Image
     image = cv2.imread(image_path)
     if image is None:
         print(f"Error: Could not load image {image_path}")
         return
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    detector = Detector(
-            families=tag_family,
-            nthreads=1,
-            quad_decimate=1.0,
-            quad_sigma=0.0,
-            refine_edges=1,
-            decode_sharpening=0.25,
-            debug=0)
-    results = detector.detect(gray)
+    if board is None:
+        board = TagBoard.load()
 
-    if not results:
-        print("No AprilTag detected in the image.")
+    # 2. Detect the tags and compute the homography from all of them
+    fit = estimate_homography(image, make_detector(tag_family), board, tag_size_pixels)
+    if fit is None:
+        print("No usable AprilTag detected in the image.")
         return
 
-    # Assume the first detected tag is the one we want to use
-    tag = results[0]
-    print(f"Detected Tag ID: {tag.tag_id}")
-
-    # 2. Define Source and Destination Points
-    # Source points are the corners of the detected tag in the original image
-    src_points = tag.corners.astype(np.float32)
-
-    # Destination points are the corners of the tag in the ideal, rectified image
-    # We define a square of the desired size, ensuring the center aligns
-    half_size = tag_size_pixels // 2
-    # The order of corners in the tag is typically top-left, top-right, bottom-right, bottom-left
-    dst_points = np.array([
-        [-half_size, -half_size],
-        [half_size, -half_size],
-        [half_size, half_size],
-        [-half_size, half_size]
-    ], dtype=np.float32)
-    # Shift points to start from the top-left corner (0, 0) of the new image
-    dst_points += np.array([half_size, half_size])
-
-    # 3. Compute Homography Matrix
-    # The homography H maps src_points to dst_points
-    H, _ = cv2.findHomography(src_points, dst_points, cv2.RANSAC, 5.0)
-
-    if H is None:
-        print("Error: Could not compute homography.")
-        return
+    print(f"Detected Tag IDs: {fit['tags']}, {fit['inliers']}/{fit['points']} corners, "
+          f"RMS error {fit['rms_error']:.2f} px")
+    H = fit['H']
 
-    # 4. Apply Perspective Warp to Rectify the Image
+    # 3. Apply Perspective Warp to Rectify the Image
     # Determine the size of the output image (large enough to see the tag clearly)
     # output_size = (tag_size_pixels, tag_size_pixels)
     output_size = (image.shape[1], image.shape[0])
     rectified_image = cv2.warpPerspective(image, H, output_size)
 
-    # 5. Display or Save the Results
+    # 4. Display or Save the Results
     cv2.imshow("Original Image", image)
     cv2.imshow("Rectified Image", rectified_image)
     cv2.imwrite("rectified_image.png", rectified_image)
@@ -0,0 +1,59 @@
+# Thin client for arm_daemon.py: only the standard library is imported here
+# so sending a command doesn't pay for OpenCV/the model SDK start up.
+import argparse
+import json
+import socket
+import sys
+
+SOCKET_PATH = '/tmp/85water.sock'
+
+def request(req, socket_path=SOCKET_PATH, timeout=60.0):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(req) + '\n').encode())
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send a command to the arm service")
+    parser.add_argument('text', nargs='*', help="command text, e.g. move the red box to the upper left")
+    parser.add_argument('--speech', action='store_true', help="get the command from the microphone")
+    parser.add_argument('--hint', action='store_true',
+                        help="text is a partial transcript: only pre-position the arm")
+    parser.add_argument('--status', action='store_true')
+    parser.add_argument('--positions', action='store_true')
+    parser.add_argument('--shutdown', action='store_true')
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    args = parser.parse_args()
+
+    if args.status:
+        req = {'cmd': 'status'}
+    elif args.positions:
+        req = {'cmd': 'positions'}
+    elif args.shutdown:
+        req = {'cmd': 'shutdown'}
+    else:
+        text = ' '.join(args.text)
+        if args.speech:
+            # only pulled in when asked for
+            import internal_speech
+            text = internal_speech.get_speech()
+        if not text:
+            print("Input your command: ")
+            text = input()
+        req = {'cmd': 'hint' if args.hint else 'text', 'text': text}
+
+    try:
+        resp = request(req, args.socket)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"Arm service is not running (no socket at {args.socket})")
+        sys.exit(1)
+    print(json.dumps(resp, indent=2))
+    if not resp.get('ok'):
+        sys.exit(1)
@@ -0,0 +1,381 @@
+"""
+Long-running arm service.
+
+Everything expensive (OpenCV, AprilTag detector, camera, undistortion,
+serial link, IK, model client) is set up once at startup. Commands come in
+as newline-delimited JSON over a Unix socket, see arm_client.py.
+
+Requests:
+    {"cmd": "text", "text": "move the red box to the upper left"}
+    {"cmd": "command", "source": "red box", "destination": "upper left corner"}
+    {"cmd": "hint", "text": "move the red"}     (partial transcript, see speculative.py)
+    {"cmd": "positions"}
+    {"cmd": "status"}
+    {"cmd": "shutdown"}
+"""
+import asyncio
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from typing import Optional
+
+SOCKET_PATH = '/tmp/85water.sock'
+
+
+class VisionLoop:
+    def __init__(self, tracker, camera_index: int = 0, homography_refresh: float = 5.0, max_error: float = 2.0,
+                 max_shift: float = 1.0, min_inlier_ratio: float = 0.8, min_tags: int = 3):
+        """
+        Captures and rectifies frames continuously and feeds the box tracker.
+
+        Undistortion and the homography are applied with one cached remap
+        (remap_cache.rectify_maps). The homography is refreshed every
+        homography_refresh seconds; fits with an RMS error above max_error
+        pixels (e.g. tags partly hidden by the arm) are ignored, as are fits
+        where less than min_inlier_ratio of the corners or fewer than
+        min_tags whole tags (all of them on smaller boards) are inliers, since
+        the RMS error only covers the inliers. The maps are only rebuilt if
+        the view moved more than max_shift pixels.
+        """
+        import cv2
+        import apriltag_homography
+        import camera_disp_undistort
+        import remap_cache
+
+        self.cv2 = cv2
+        self.apriltag_homography = apriltag_homography
+        self.camera_disp_undistort = camera_disp_undistort
+        self.remap_cache = remap_cache
+        self.tracker = tracker
+        self.detector = apriltag_homography.make_detector()
+        self.board = apriltag_homography.TagBoard.load()
+        self.max_error = max_error
+        self.max_shift = max_shift
+        self.min_inlier_ratio = min_inlier_ratio
+        self.min_tags = min_tags
+        self.maps = None            # raw frame -> rectified view
+        self.fit = None             # last accepted homography fit
+        self.new_K = camera_disp_undistort.new_camera_matrix()
+        self.homography_refresh = homography_refresh
+        self.H = None
+        self.H_time = 0.0
+        self.frame = None           # latest raw frame
+        self.rectified = None       # latest rectified frame
+        self.frame_time = 0.0
+        self.cap = cv2.VideoCapture(camera_index)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, camera_disp_undistort.IMG_WIDTH)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, camera_disp_undistort.IMG_HEIGHT)
+        if not self.cap.isOpened():
+            raise RuntimeError("Could not open camera")
+        self._running = False
+        self._thread = None
+
+    def _acceptable(self, fit) -> bool:
+        if fit is None or fit['rms_error'] > self.max_error:
+            return False
+        if fit['inlier_ratio'] < self.min_inlier_ratio:
+            return False
+        # A single tag is all a fit without a board has
+        needed = 1 if self.board is None else min(self.min_tags, len(self.board.tags))
+        return fit['inlier_tags'] >= needed
+
+    def step(self) -> bool:
+        ret, frame = self.cap.read()
+        if not ret:
+            print("Error: Failed to capture image.")
+            return False
+        t = time.monotonic()
+        size = (frame.shape[1], frame.shape[0])
+        if self.H is None or t - self.H_time > self.homography_refresh:
+            # Tags are found in the undistorted image, only needed on refresh
+            undistorted = self.camera_disp_undistort.undistort_frame(frame, self.new_K)
+            fit = self.apriltag_homography.estimate_homography(undistorted, self.detector, self.board)
+            if self._acceptable(fit):
+                self.H_time, self.fit = t, fit
+                if self.H is None or self.remap_cache.corner_shift(self.H, fit['H'], size) > self.max_shift:
+                    self.H = fit['H']
+                    self.maps = self.remap_cache.rectify_maps(self.H, self.camera_disp_undistort.K,
+                                                              self.camera_disp_undistort.D, size, self.new_K)
+        if self.maps is None:
+            return False
+        rectified = self.remap_cache.remap(frame, self.maps)
+        self.tracker.update(rectified, t)
+        self.frame, self.rectified, self.frame_time = frame, rectified, t
+        return True
+
+    def wait_frame(self, after: Optional[float] = None, timeout: float = 1.0):
+        """
+        Latest raw frame captured after the given time (defaults to now), with
+        the maps that rectify it.
+
+        Returns:
+            (frame, maps), frame is None on timeout
+        """
+        if after is None:
+            after = time.monotonic()
+        deadline = after + timeout
+        while self.frame_time <= after:
+            if time.monotonic() > deadline:
+                return None, self.maps
+            time.sleep(0.005)
+        return self.frame, self.maps
+
+    def start(self):
+        self._running = True
+
+        def run():
+            while self._running:
+                self.step()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self.cap.release()
+
+
+class ArmService:
+    def __init__(self, queue_size: int = 8, record_path: str = None, camera_index: int = 0):
+        """
+        Owns all the hardware and models; jobs are executed one at a time by
+        a worker thread from a bounded queue.
+        """
+        started = time.monotonic()
+        # Heavy imports happen here, once, not in the client
+        import IK2
+        import box_tracker
+        import detect_color
+        import grasp_verify
+        import not_slop
+        import pick_executor
+        import scheduler
+        import speculative
+        import telemetry
+        import trajectory_serial
+
+        self.not_slop = not_slop
+        self.arm = IK2.RobotArmIK()
+        self.arm.load_config('params.json')
+        # Learned box colors from color_model.py, if calibrated
+        if detect_color.load_color_model():
+            print("Using learned color model")
+        self.tracker = box_tracker.BoxTracker()
+        self.vision = VisionLoop(self.tracker, camera_index)
+
+        self.recorder = None
+        if record_path:
+            import session_log
+            self.recorder = session_log.SessionRecorder(record_path)
+
+        self.link = trajectory_serial.TrajectoryLink(recorder=self.recorder)
+        self.telemetry = telemetry.TelemetryReader(self.link)
+        self.scheduler = scheduler.PickScheduler(self.arm)
+        self.executor = pick_executor.PickExecutor(self.arm, self.link,
+                                                   verifier=grasp_verify.GraspVerifier(),
+                                                   frame_source=self.vision.wait_frame)
+        # Moves toward the likely box while the model resolves the command
+        self.speculator = speculative.Speculator(self.executor, self.tracker, self.telemetry)
+        # Held by whoever is moving the arm
+        self.arm_lock = threading.Lock()
+
+        # One event loop for the model client so its connection is reused
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self.client = not_slop.AsyncDedalus()
+
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.completed = 0
+        self.failed = 0
+        self.busy = False
+        self._running = True
+        self.vision.start()
+        self.telemetry.start()
+        # Trajectories start from the pose the firmware reports
+        if not self.executor.sync_pose(self.telemetry):
+            print("No telemetry from the arm yet, its pose is unknown")
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+        print(f"Arm service ready in {time.monotonic() - started:.1f}s")
+
+    def parse(self, text: str, timeout: float = 30.0):
+        """Resolve free text to a not_slop.Command with the shared client"""
+        future = asyncio.run_coroutine_threadsafe(self.not_slop.parse_cmd(text, self.client), self.loop)
+        return future.result(timeout)
+
+    def speculate(self, text: str) -> Optional[str]:
+        """Start moving toward the box text names, if the arm is free"""
+        if not self.arm_lock.acquire(blocking=False):
+            return None
+        try:
+            if not self.jobs.empty():
+                return None
+            return self.speculator.begin(text)
+        finally:
+            self.arm_lock.release()
+
+    def abandon_speculation(self):
+        with self.arm_lock:
+            self.speculator.resolve(())
+
+    def submit(self, command) -> bool:
+        """Queue a command; False if the queue is full"""
+        try:
+            self.jobs.put_nowait(command)
+        except queue.Full:
+            return False
+        if self.recorder:
+            self.recorder.command(command)
+        return True
+
+    def _work(self):
+        while self._running:
+            try:
+                command = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                with self.arm_lock:
+                    self.speculator.expire()
+                continue
+            self.busy = True
+            self.arm_lock.acquire()
+            try:
+                self.scheduler.add(command)
+                # Anything queued meanwhile is planned together
+                while True:
+                    try:
+                        self.scheduler.add(self.jobs.get_nowait())
+                    except queue.Empty:
+                        break
+                # Keep a speculative move that was right, the plan starts from it
+                hit = self.speculator.resolve([job.color for job in self.scheduler.jobs]) == 'hit'
+                if self.executor.servo_angles is None and not self.executor.sync_pose(self.telemetry):
+                    raise RuntimeError("arm pose unknown")
+                positions = self.tracker.positions()
+                if hit:
+                    # The gripper covers the box now, it was last seen before the move
+                    color, position = self.speculator.hit
+                    positions[color] = position
+                if self.recorder and self.vision.frame is not None:
+                    # Only the frame each plan was made from, not the whole stream
+                    self.recorder.frame(self.vision.frame)
+                    self.recorder.detection(positions)
+                plan = self.scheduler.plan(positions, self.executor.servo_angles)
+                for job in plan['blocked']:
+                    print(f"Blocked: {job}")
+                    self.failed += 1
+                for step in plan['steps']:
+                    if self.recorder:
+                        self.recorder.ik({'source': step.source_ik, 'target': step.target_ik})
+                    if self.executor.execute(step):
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+            except Exception as e:
+                print(f"Job failed: {e}")
+                self.failed += 1
+            finally:
+                self.scheduler.clear()
+                self.arm_lock.release()
+                self.busy = False
+                if self.recorder:
+                    self.recorder.flush()
+
+    def status(self) -> dict:
+        return {
+            'queued': self.jobs.qsize(),
+            'queue_size': self.jobs.maxsize,
+            'busy': self.busy,
+            'completed': self.completed,
+            'failed': self.failed,
+            'positions': self.tracker.positions(),
+            'telemetry': self.telemetry.summary(window=100),
+            'speculation': self.speculator.stats(),
+            'homography': {k: v for k, v in (self.vision.fit or {}).items() if k != 'H'}
+        }
+
+    def handle(self, request: dict) -> dict:
+        cmd = request.get('cmd')
+        if cmd == 'text':
+            # The arm starts moving on the local guess while the model parses
+            guess = self.speculate(request['text'])
+            try:
+                command = self.parse(request['text'])
+            except Exception:
+                self.abandon_speculation()
+                raise
+            if not self.submit(command):
+                self.abandon_speculation()
+                return {'ok': False, 'error': 'busy', 'queued': self.jobs.qsize()}
+            return {'ok': True, 'command': command.model_dump(), 'speculated': guess, 'queued': self.jobs.qsize()}
+        if cmd == 'hint':
+            return {'ok': True, 'speculated': self.speculate(request['text'])}
+        if cmd == 'command':
+            command = self.not_slop.Command(Source=request['source'], Destination=request['destination'])
+            if not self.submit(command):
+                return {'ok': False, 'error': 'busy', 'queued': self.jobs.qsize()}
+            return {'ok': True, 'queued': self.jobs.qsize()}
+        if cmd == 'positions':
+            return {'ok': True, 'positions': self.tracker.positions()}
+        if cmd == 'status':
+            return {'ok': True, **self.status()}
+        if cmd == 'shutdown':
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {'ok': True}
+        return {'ok': False, 'error': f"unknown cmd: {cmd}"}
+
+    def close(self):
+        self._running = False
+        self.worker.join()
+        self.vision.stop()
+        self.telemetry.stop()
+        if self.recorder:
+            self.recorder.close()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.service.handle(json.loads(line))
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response, default=str) + '\n').encode())
+            self.wfile.flush()
+
+
+def serve(socket_path: str = SOCKET_PATH, **kwargs):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    service = ArmService(**kwargs)
+    with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        server.daemon_threads = True
+        server.service = service
+        service.server = server
+        print(f"Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
+            os.remove(socket_path)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Resident arm service")
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    parser.add_argument('--queue-size', type=int, default=8)
+    parser.add_argument('--record', help="session log to record to")
+    parser.add_argument('--camera', type=int, default=0)
+    args = parser.parse_args()
+    serve(args.socket, queue_size=args.queue_size, record_path=args.record, camera_index=args.camera)
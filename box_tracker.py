@@ -0,0 +1,220 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import detect_color
+
+
+class Track:
+    """State of one tracked box, in rectified image pixels"""
+    def __init__(self, color: str, bbox: Tuple[int, int, int, int], t: float):
+        x, y, w, h = bbox
+        self.color = color
+        self.x = x + w / 2          # Box center
+        self.y = y + h / 2
+        self.vx = 0.0               # Velocity (px/s)
+        self.vy = 0.0
+        self.w = w
+        self.h = h
+        self.last_update = t        # Time of the last filter step
+        self.last_seen = t          # Time of the last successful detection
+        self.confidence = 0.5
+        self.misses = 0
+
+    def predict(self, t: float) -> Tuple[float, float]:
+        """Predicted box center at time t"""
+        dt = t - self.last_update
+        return (self.x + self.vx * dt, self.y + self.vy * dt)
+
+    def bbox(self) -> Tuple[int, int, int, int]:
+        return (int(self.x - self.w / 2), int(self.y - self.h / 2), int(self.w), int(self.h))
+
+
+class BoxTracker:
+    def __init__(self,
+                 colors=('red', 'green', 'blue'),
+                 roi_margin: int = 20,
+                 alpha: float = 0.6,
+                 beta: float = 0.2,
+                 lost_after: float = 1.0,
+                 half_life: float = 0.25,
+                 min_area: float = 50.0,
+                 color_model=None,
+                 learn_confidence: float = 0.9):
+        """
+        Tracks the colored boxes between frames with an alpha-beta filter.
+
+        Each frame only a small ROI around the predicted position of every
+        box is checked; full-frame detection is only run for boxes that have
+        no track or whose track was lost.
+
+        Args:
+            colors: Box colors to track (keys of detect_color.COLOR_RANGES)
+            roi_margin: Pixels added around the predicted bbox for the ROI check
+            alpha: Position gain of the filter
+            beta: Velocity gain of the filter
+            lost_after: Seconds without a detection before a track is dropped
+            half_life: Seconds without a detection that halve a track's
+                confidence, independent of the frame rate
+            min_area: Smallest blob (pixels) accepted as a box
+            color_model: color_model.ColorModel for detection (defaults to
+                detect_color.COLOR_MODEL); it is updated from detections
+                of tracks at least learn_confidence confident
+            learn_confidence: Track confidence needed to learn from a detection
+        """
+        self.colors = tuple(colors)
+        self.roi_margin = roi_margin
+        self.alpha = alpha
+        self.beta = beta
+        self.lost_after = lost_after
+        self.half_life = half_life
+        self.min_area = min_area
+        self.color_model = color_model
+        self.learn_confidence = learn_confidence
+        self.tracks: Dict[str, Track] = {}
+        self.full_detections = 0    # Number of full-frame fallbacks, for tuning
+        self._lock = threading.Lock()
+
+    def update(self, frame, t: Optional[float] = None):
+        """
+        Update all tracks from a new rectified frame.
+
+        Args:
+            frame: Rectified BGR image
+            t: Capture time in seconds (defaults to time.monotonic())
+        """
+        if t is None:
+            t = time.monotonic()
+        frame_h, frame_w = frame.shape[:2]
+
+        for color in self.colors:
+            with self._lock:
+                track = self.tracks.get(color)
+
+            confident = False
+            if track is not None:
+                bbox = self._roi_check(frame, track, t, frame_w, frame_h)
+                with self._lock:
+                    if bbox is not None:
+                        self._correct(track, bbox, t)
+                        confident = track.confidence >= self.learn_confidence
+                    else:
+                        self._miss(track, t)
+                    if self._is_lost(track, t):
+                        del self.tracks[color]
+                        track = None
+                model = self.color_model if self.color_model is not None else detect_color.COLOR_MODEL
+                if bbox is not None and confident and model:
+                    model.update(frame, color, bbox, t)
+
+            if track is None:
+                # Lost or never seen: fall back to full-frame detection
+                self.full_detections += 1
+                bbox = detect_color.detect_box(frame, color, self.min_area, self.color_model)
+                if bbox is not None:
+                    with self._lock:
+                        self.tracks[color] = Track(color, bbox, t)
+
+    def _roi_check(self, frame, track: Track, t: float, frame_w: int, frame_h: int):
+        """Look for the box in a small window around its predicted position"""
+        px, py = track.predict(t)
+        dt = t - track.last_update
+        # Grow the window with the distance the box could have moved
+        margin = self.roi_margin + int(abs(track.vx * dt) + abs(track.vy * dt))
+        x0 = max(int(px - track.w / 2) - margin, 0)
+        y0 = max(int(py - track.h / 2) - margin, 0)
+        x1 = min(int(px + track.w / 2) + margin, frame_w)
+        y1 = min(int(py + track.h / 2) + margin, frame_h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        bbox = detect_color.detect_box(frame[y0:y1, x0:x1], track.color, self.min_area, self.color_model)
+        if bbox is None:
+            return None
+        x, y, w, h = bbox
+        return (x + x0, y + y0, w, h)
+
+    def _correct(self, track: Track, bbox, t: float):
+        """Alpha-beta filter step with a new measurement"""
+        x, y, w, h = bbox
+        mx, my = x + w / 2, y + h / 2
+        dt = t - track.last_update
+        px, py = track.predict(t)
+        rx, ry = mx - px, my - py
+        track.x = px + self.alpha * rx
+        track.y = py + self.alpha * ry
+        if dt > 0:
+            track.vx += self.beta * rx / dt
+            track.vy += self.beta * ry / dt
+        track.w, track.h = w, h
+        track.last_update = t
+        track.last_seen = t
+        track.confidence = min(1.0, track.confidence + 0.2)
+        track.misses = 0
+
+    def _miss(self, track: Track, t: float):
+        """Coast the track forward without a measurement"""
+        dt = t - track.last_update
+        track.x, track.y = track.predict(t)
+        track.last_update = t
+        track.confidence *= 0.5 ** (dt / self.half_life)
+        track.misses += 1
+
+    def _is_lost(self, track: Track, t: float) -> bool:
+        # Only time drops a track, so a box briefly hidden by the arm is kept
+        return t - track.last_seen > self.lost_after
+
+    def get(self, color: str, t: Optional[float] = None) -> Optional[Tuple[float, float]]:
+        """
+        Current estimate of a box position without capturing a new frame.
+
+        Args:
+            color: Box color
+            t: Time to predict for (defaults to now)
+
+        Returns:
+            (x, y) box center in mm, or None if the box is not tracked
+        """
+        if t is None:
+            t = time.monotonic()
+        with self._lock:
+            track = self.tracks.get(color)
+            if track is None:
+                return None
+            x, y = track.predict(t)
+        return (x * detect_color.PX_TO_MM, y * detect_color.PX_TO_MM)
+
+    def positions(self, t: Optional[float] = None) -> Dict[str, Tuple[float, float]]:
+        """Estimated position (mm) of every tracked box"""
+        result = {}
+        for color in self.colors:
+            pos = self.get(color, t)
+            if pos is not None:
+                result[color] = pos
+        return result
+
+    def confidence(self, color: str) -> float:
+        with self._lock:
+            track = self.tracks.get(color)
+            return track.confidence if track is not None else 0.0
+
+    def reset(self):
+        with self._lock:
+            self.tracks.clear()
+
+
+# Example usage
+if __name__ == "__main__":
+    import sys
+    import cv2
+
+    tracker = BoxTracker()
+    for p in sys.argv[1:]:
+        img = cv2.imread(p)
+        if img is None:
+            print(f"Error: Could not load image {p}")
+            continue
+        tracker.update(img)
+        for color, (x, y) in tracker.positions().items():
+            print(f"{p}: {color} box at x: {x:.1f}, y: {y:.1f} (confidence {tracker.confidence(color):.2f})")
+    print(f"Full-frame detections: {tracker.full_detections}")
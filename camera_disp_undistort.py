@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+import remap_cache
 
 # Get the optimal new camera matrix and region of interest
 # The getOptimalNewCameraMatrix function is for the standard pinhole model,
@@ -7,14 +8,32 @@ import numpy as np
 # or directly undistort with scaling/cropping options.
 # For simplicity here, we'll use a standard approach for the new matrix.
 # DIM=(640, 480)
-def capture_and_undistort(img_name):
-    K=np.array([[459.50075535511127, 0.0, 315.4093020757232], [0.0, 456.5667192722284, 232.44968716323072], [0.0, 0.0, 1.0]])
-    D=np.array([[-0.11675163361043045], [0.07398723179179927], [-0.01466585277138975], [-0.047624989531767185]])
-    img_width, img_height = 640, 480 # Must match the resolution used in calibration
+K=np.array([[459.50075535511127, 0.0, 315.4093020757232], [0.0, 456.5667192722284, 232.44968716323072], [0.0, 0.0, 1.0]])
+D=np.array([[-0.11675163361043045], [0.07398723179179927], [-0.01466585277138975], [-0.047624989531767185]])
+IMG_WIDTH, IMG_HEIGHT = 640, 480 # Must match the resolution used in calibration
+
+# You can adjust 'balance' from 0.0 (maximum zoom/crop) to 1.0 (keep all pixels, but might show black borders)
+BALANCE = 0.5
+
+def new_camera_matrix():
+    """Camera matrix of the undistorted images"""
+    return cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (IMG_WIDTH, IMG_HEIGHT), np.eye(3), BALANCE)
 
-    # You can adjust 'balance' from 0.0 (maximum zoom/crop) to 1.0 (keep all pixels, but might show black borders)
-    balance = 0.5 
-    new_K = cv2.fisheye.estimateNewCameraMatrixForUndistortRectify(K, D, (img_width, img_height), np.eye(3), balance)
+def undistort_maps(new_K=None, size=None):
+    """Remap tables for this calibration, built once and cached on disk (see remap_cache.py)"""
+    if new_K is None:
+        new_K = new_camera_matrix()
+    if size is None:
+        size = (IMG_WIDTH, IMG_HEIGHT)
+    return remap_cache.undistort_maps(K, D, size, new_K)
+
+def undistort_frame(frame, new_K=None):
+    """Undistort one captured frame in memory"""
+    return remap_cache.remap(frame, undistort_maps(new_K, (frame.shape[1], frame.shape[0])))
+
+def capture_and_undistort(img_name):
+    img_width, img_height = IMG_WIDTH, IMG_HEIGHT
+    new_K = new_camera_matrix()
 
     # --- 2. Setup Video Capture and Stream ---
     
@@ -41,7 +60,7 @@ def capture_and_undistort(img_name):
     
             # --- 3. Undistort the frame ---
             # Use cv2.fisheye.undistortImage with the new camera matrix
-            undistorted_frame = cv2.fisheye.undistortImage(frame, K, D, Knew=new_K)
+            undistorted_frame = undistort_frame(frame, new_K)
             print("Undisorited capture")
             # --- 4. Display the results ---
             #cv2.imshow('Original Fisheye Stream', frame)
@@ -0,0 +1,194 @@
+import numpy as np
+from typing import Dict, List, Tuple
+
+import IK2
+
+
+def segment_distance(p1, q1, p2, q2) -> np.ndarray:
+    """
+    Minimum distance between segments p1-q1 and p2-q2.
+
+    All arguments are arrays of shape (..., 3) and are broadcast against
+    each other, so a batch of link segments can be tested against a batch
+    of obstacles in one call.
+
+    Returns:
+        Array of distances with the broadcast shape (without the last axis)
+    """
+    eps = 1e-9
+    d1 = q1 - p1
+    d2 = q2 - p2
+    r = p1 - p2
+    a = np.sum(d1 * d1, axis=-1)
+    e = np.sum(d2 * d2, axis=-1)
+    b = np.sum(d1 * d2, axis=-1)
+    c = np.sum(d1 * r, axis=-1)
+    f = np.sum(d2 * r, axis=-1)
+    a_safe = np.maximum(a, eps)
+    e_safe = np.maximum(e, eps)
+
+    # Closest point parameters of the infinite lines, clamped to the segments
+    denom = a * e - b * b
+    s = np.where(denom > eps, np.clip((b * f - c * e) / np.maximum(denom, eps), 0.0, 1.0), 0.0)
+    t = (b * s + f) / e_safe
+
+    # Re-clamp s when t falls outside of its segment
+    s = np.where(t < 0.0, np.clip(-c / a_safe, 0.0, 1.0), s)
+    s = np.where(t > 1.0, np.clip((b - c) / a_safe, 0.0, 1.0), s)
+    t = np.clip(t, 0.0, 1.0)
+
+    # Degenerate segments: the second one is a point (e.g. a sphere obstacle)
+    s = np.where(e <= eps, np.clip(-c / a_safe, 0.0, 1.0), s)
+    t = np.where(e <= eps, 0.0, t)
+    # ... or the first one is
+    s = np.where(a <= eps, 0.0, s)
+    t = np.where(a <= eps, np.clip(f / e_safe, 0.0, 1.0), t)
+
+    c1 = p1 + d1 * s[..., None]
+    c2 = p2 + d2 * t[..., None]
+    return np.linalg.norm(c1 - c2, axis=-1)
+
+
+def interpolate(start, end, steps: int) -> np.ndarray:
+    """
+    Sample a straight joint-space move.
+
+    Args:
+        start: Starting joint angles, shape (4,)
+        end: Final joint angles, shape (4,)
+        steps: Number of samples (including both ends)
+
+    Returns:
+        Array of shape (steps, 4)
+    """
+    s = np.linspace(0.0, 1.0, steps)[:, None]
+    start = np.asarray(start, dtype=float)
+    end = np.asarray(end, dtype=float)
+    return start + s * (end - start)
+
+
+class CollisionChecker:
+    def __init__(self,
+                 arm: IK2.RobotArmIK,
+                 table_z: float = 0.0,
+                 table_margin: float = 5.0,
+                 tip_tolerance: float = 2.0,
+                 base_radius: float = 45.0,
+                 link_radius: float = 12.0,
+                 gripper_radius: float = 20.0):
+        """
+        Checks batches of arm configurations against joint limits, the
+        table plane, the base column and capsule obstacles.
+
+        Args:
+            arm: RobotArmIK providing link lengths and servo calibration
+            table_z: Height of the table surface (mm)
+            table_margin: Clearance the elbow and wrist must keep above the table (mm)
+            tip_tolerance: How far the grabber tip may go below the table (mm)
+            base_radius: Radius of the base column around the z axis (mm)
+            link_radius: Radius of the arm links (mm)
+            gripper_radius: Radius of the gripper, wrist to tip (mm)
+        """
+        self.arm = arm
+        self.table_z = table_z
+        self.table_margin = table_margin
+        self.tip_tolerance = tip_tolerance
+        self.base_radius = base_radius
+        self.link_radius = link_radius
+        self.gripper_radius = gripper_radius
+        self.obstacles: List[Tuple[np.ndarray, np.ndarray, float]] = []
+
+    def add_capsule(self, p0, p1, radius: float):
+        """
+        Add a capsule obstacle (a sphere if p0 == p1).
+
+        Args:
+            p0, p1: (x, y, z) end points of the capsule axis in mm
+            radius: Capsule radius in mm
+        """
+        self.obstacles.append((np.asarray(p0, dtype=float), np.asarray(p1, dtype=float), float(radius)))
+
+    def clear_obstacles(self):
+        self.obstacles = []
+
+    def check(self, world_angles, angle_type: str = 'world') -> Dict[str, np.ndarray]:
+        """
+        Test a batch of configurations in one pass.
+
+        Args:
+            world_angles: Array of shape (N, 4) of joint1..joint4 angles in degrees
+            angle_type: 'world' or 'servo' - specifies the type of input angles
+
+        Returns:
+            Dictionary of boolean arrays of shape (N,), True where the check
+            passes: 'joint_limits', 'table', 'base', 'obstacles' and 'ok'
+        """
+        angles = np.asarray(world_angles, dtype=float).reshape(-1, 4)
+        if angle_type == 'servo':
+            servo_angles = angles
+            angles = self.arm.servo_to_world_angles(servo_angles)
+        else:
+            servo_angles = self.arm.world_to_servo_angles(angles)
+
+        joint_ok = self.arm.within_servo_limits(servo_angles)
+
+        # (N, 4, 3): shoulder, elbow, wrist, tip
+        points = self.arm.forward_kinematics_batch(angles)
+        starts = points[:, :-1]
+        ends = points[:, 1:]
+        radii = np.array([self.link_radius, self.link_radius, self.gripper_radius])
+
+        # Links are straight, so the lowest point of each is one of its joints
+        z = points[:, :, 2]
+        table_ok = (np.all(z[:, 1:3] - self.link_radius >= self.table_z + self.table_margin, axis=1)
+                    & (z[:, 3] >= self.table_z - self.tip_tolerance))
+
+        # The first link is mounted on the base column, only check the others
+        base_p0 = np.array([0.0, 0.0, self.table_z])
+        base_p1 = np.array([0.0, 0.0, self.arm.h_base])
+        base_dist = segment_distance(starts[:, 1:], ends[:, 1:], base_p0, base_p1)
+        base_ok = np.all(base_dist > self.base_radius + radii[1:], axis=1)
+
+        if self.obstacles:
+            obs_p0 = np.stack([o[0] for o in self.obstacles])
+            obs_p1 = np.stack([o[1] for o in self.obstacles])
+            obs_r = np.array([o[2] for o in self.obstacles])
+            # (N, 3 links, M obstacles)
+            dist = segment_distance(starts[:, :, None], ends[:, :, None], obs_p0, obs_p1)
+            obstacles_ok = np.all(dist > radii[None, :, None] + obs_r, axis=(1, 2))
+        else:
+            obstacles_ok = np.ones(angles.shape[0], dtype=bool)
+
+        return {
+            'joint_limits': joint_ok,
+            'table': table_ok,
+            'base': base_ok,
+            'obstacles': obstacles_ok,
+            'ok': joint_ok & table_ok & base_ok & obstacles_ok
+        }
+
+    def is_valid(self, world_angles, angle_type: str = 'world') -> bool:
+        """True if every configuration in the batch passes all checks"""
+        return bool(np.all(self.check(world_angles, angle_type)['ok']))
+
+    def first_collision(self, world_angles, angle_type: str = 'world') -> int:
+        """Index of the first failing configuration, or -1 if all pass"""
+        bad = np.flatnonzero(~self.check(world_angles, angle_type)['ok'])
+        return int(bad[0]) if bad.size else -1
+
+
+# Example usage
+if __name__ == "__main__":
+    arm = IK2.RobotArmIK()
+    checker = CollisionChecker(arm)
+    checker.add_capsule((150.0, -50.0, 0.0), (150.0, 50.0, 0.0), 20.0)
+
+    start = arm.inverse_kinematics(127.0, 0.0, 10.0)
+    end = arm.inverse_kinematics(100.0, 80.0, 10.0)
+    if start and end:
+        traj = interpolate([start['world_angles'][j] for j in IK2.JOINTS],
+                           [end['world_angles'][j] for j in IK2.JOINTS], 200)
+        result = checker.check(traj)
+        for name, ok in result.items():
+            print(f"  {name:13s}: {int(np.sum(ok))}/{len(ok)} ok")
+        print(f"First collision at sample {checker.first_collision(traj)}")
@@ -0,0 +1,245 @@
+import time
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Histogram bins per BGR channel: 2^BITS
+BITS = 5
+BINS = 1 << BITS
+SHIFT = 8 - BITS
+MODEL_PATH = 'color_model.npz'
+
+
+def bin_index(pixels: np.ndarray) -> np.ndarray:
+    """Flat histogram bin of each BGR pixel (any shape ending in 3)"""
+    q = (pixels >> SHIFT).astype(np.uint16)
+    return (q[..., 0] << (2 * BITS)) | (q[..., 1] << BITS) | q[..., 2]
+
+
+def _smooth(hist: np.ndarray) -> np.ndarray:
+    """3x3x3 box blur of a flat BINS^3 histogram, so nearby colors count too"""
+    h = hist.reshape(BINS, BINS, BINS)
+    for axis in range(3):
+        padded = np.pad(h, [(1, 1) if a == axis else (0, 0) for a in range(3)])
+        h = (padded.take(range(0, BINS), axis=axis)
+             + padded.take(range(1, BINS + 1), axis=axis)
+             + padded.take(range(2, BINS + 2), axis=axis))
+    return h.reshape(-1) / 27.0
+
+
+def _shrink(bbox, fraction: float):
+    """Inner part of a bbox, so box edges and shadows aren't learned"""
+    x, y, w, h = bbox
+    dx, dy = int(w * fraction / 2), int(h * fraction / 2)
+    return (x + dx, y + dy, max(w - 2 * dx, 1), max(h - 2 * dy, 1))
+
+
+class ColorModel:
+    def __init__(self,
+                 colors=('red', 'green', 'blue'),
+                 min_ratio: float = 2.0,
+                 min_probability: float = 1e-4,
+                 time_constant: float = 120.0,
+                 rebuild_period: float = 5.0):
+        """
+        Per-color histograms in quantized BGR space, compiled to a lookup
+        table that labels every pixel with one array index.
+
+        Args:
+            colors: Class names
+            min_ratio: A bin only gets a color if it is this many times more
+                likely under that color than under the background
+            min_probability: Bins less likely than this are never labelled
+            time_constant: Seconds of update() samples it takes to replace
+                about two thirds of the calibration
+            rebuild_period: update() samples are collected for this long (s)
+                before they are blended in and the lookup table rebuilt
+        """
+        self.colors = tuple(colors)
+        self.min_ratio = min_ratio
+        self.min_probability = min_probability
+        self.time_constant = time_constant
+        self.rebuild_period = rebuild_period
+        # Row 0 is the background, row i + 1 is colors[i]
+        self.hist = np.zeros((len(self.colors) + 1, BINS ** 3), dtype=np.float32)
+        self.lut = np.zeros(BINS ** 3, dtype=np.uint8)
+        self.updates = 0
+        self.rebuilds = 0
+        self._pending = np.zeros_like(self.hist)    # update() samples not blended in yet
+        self._last_rebuild = None
+
+    def _row(self, color: Optional[str]) -> int:
+        return 0 if color is None else self.colors.index(color) + 1
+
+    def add_samples(self, color: Optional[str], pixels: np.ndarray, weight: float = 1.0):
+        """
+        Accumulate labelled pixels (color None for background). Call build()
+        afterwards.
+        """
+        counts = np.bincount(bin_index(pixels.reshape(-1, 3)), minlength=BINS ** 3)
+        self.hist[self._row(color)] += weight * counts.astype(np.float32)
+
+    def build(self):
+        """Compile the histograms into the lookup table"""
+        likelihood = np.empty(self.hist.shape, dtype=np.float32)
+        for i, hist in enumerate(self.hist):
+            total = hist.sum()
+            likelihood[i] = _smooth(hist) / total if total > 0 else 0.0
+        best = np.argmax(likelihood[1:], axis=0)
+        p = likelihood[1:][best, np.arange(BINS ** 3)]
+        keep = (p > self.min_probability) & (p > self.min_ratio * likelihood[0])
+        self.lut = np.where(keep, best + 1, 0).astype(np.uint8)
+
+    def labels(self, image: np.ndarray) -> np.ndarray:
+        """Class of every pixel: 0 for background, i + 1 for colors[i]"""
+        return self.lut[bin_index(image)]
+
+    def mask(self, image: np.ndarray, color: str) -> np.ndarray:
+        """Binary mask like cv2.inRange"""
+        return (self.labels(image) == self._row(color)).astype(np.uint8) * 255
+
+    def calibrate(self, image: np.ndarray, boxes: Dict[str, Tuple[int, int, int, int]],
+                  shrink: float = 0.3, margin: int = 10, background_step: int = 4):
+        """
+        One-shot calibration from a frame with known box locations.
+
+        Args:
+            image: BGR frame
+            boxes: color -> (x, y, w, h) of each reference patch
+            shrink: Fraction of each bbox left out around the edges
+            margin: Pixels around each bbox not used as background
+            background_step: Only every n-th background pixel is used
+        """
+        background = np.ones(image.shape[:2], dtype=bool)
+        for color, bbox in boxes.items():
+            x, y, w, h = _shrink(bbox, shrink)
+            self.add_samples(color, image[y:y + h, x:x + w])
+            x, y, w, h = bbox
+            background[max(y - margin, 0):y + h + margin, max(x - margin, 0):x + w + margin] = False
+        self.add_samples(None, image[::background_step, ::background_step][background[::background_step, ::background_step]])
+        self.build()
+
+    def update(self, image: np.ndarray, color: str, bbox: Tuple[int, int, int, int],
+               t: Optional[float] = None, shrink: float = 0.3, margin: int = 10) -> bool:
+        """
+        Collect a confidently detected box (and a ring of background around
+        it), so the model follows slow lighting changes.
+
+        Samples are only blended in every rebuild_period seconds, weighted
+        by the time since the last blend, so the adaptation speed doesn't
+        depend on the frame rate.
+
+        Args:
+            image: BGR frame the detection came from
+            color: Detected color
+            bbox: (x, y, w, h) of the detection
+            t: Capture time in seconds (defaults to time.monotonic())
+
+        Returns:
+            True if the lookup table was rebuilt
+        """
+        x, y, w, h = bbox
+        frame_h, frame_w = image.shape[:2]
+        ix, iy, iw, ih = _shrink(bbox, shrink)
+        patch = image[iy:iy + ih, ix:ix + iw]
+        if patch.size == 0:
+            return False
+        x0, y0 = max(x - 2 * margin, 0), max(y - 2 * margin, 0)
+        x1, y1 = min(x + w + 2 * margin, frame_w), min(y + h + 2 * margin, frame_h)
+        ring = np.ones((y1 - y0, x1 - x0), dtype=bool)
+        ring[max(y - margin - y0, 0):y + h + margin - y0, max(x - margin - x0, 0):x + w + margin - x0] = False
+        surrounding = image[y0:y1, x0:x1][ring]
+
+        for row, pixels in ((self._row(color), patch), (0, surrounding)):
+            if pixels.size:
+                self._pending[row] += np.bincount(bin_index(pixels.reshape(-1, 3)), minlength=BINS ** 3)
+        self.updates += 1
+
+        if t is None:
+            t = time.monotonic()
+        if self._last_rebuild is None:
+            self._last_rebuild = t
+            return False
+        elapsed = t - self._last_rebuild
+        if elapsed < self.rebuild_period:
+            return False
+        rate = 1.0 - np.exp(-elapsed / self.time_constant)
+        for row in range(len(self.hist)):
+            count = self._pending[row].sum()
+            if count == 0:
+                continue
+            total = self.hist[row].sum()
+            # Keep the total mass, so old and new samples decay at the same rate
+            scale = total / count if total > 0 else 1.0
+            self.hist[row] = (1 - rate) * self.hist[row] + rate * scale * self._pending[row]
+        self._pending[:] = 0
+        self._last_rebuild = t
+        self.rebuilds += 1
+        self.build()
+        return True
+
+    def save(self, path: str = MODEL_PATH):
+        np.savez(path, colors=np.array(self.colors), hist=self.hist, lut=self.lut,
+                 params=np.array([self.min_ratio, self.min_probability, self.time_constant, self.rebuild_period]))
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> 'ColorModel':
+        data = np.load(path)
+        min_ratio, min_probability, time_constant, rebuild_period = data['params']
+        model = cls(tuple(str(c) for c in data['colors']), float(min_ratio), float(min_probability),
+                    float(time_constant), float(rebuild_period))
+        model.hist = data['hist']
+        model.lut = data['lut']
+        return model
+
+
+def calibrate_from_frame(image: np.ndarray, colors=('red', 'green', 'blue'), boxes: Dict = None) -> Optional[ColorModel]:
+    """
+    Build a ColorModel from one rectified frame.
+
+    Boxes not given are located with the hand-tuned detect_color.COLOR_RANGES,
+    so these only have to be roughly right under the calibration lighting.
+
+    Returns:
+        The model, or None if a color could not be found
+    """
+    import detect_color
+
+    boxes = dict(boxes or {})
+    for color in colors:
+        if color not in boxes:
+            bbox = detect_color.detect_box(image, color, min_area=50, model=False)
+            if bbox is None:
+                print(f"Could not find the {color} box for calibration")
+                return None
+            boxes[color] = bbox
+    model = ColorModel(colors)
+    model.calibrate(image, boxes)
+    return model
+
+
+# Example usage
+if __name__ == "__main__":
+    import argparse
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Learn box colors from a calibration frame")
+    parser.add_argument('image', help="rectified calibration frame")
+    parser.add_argument('-o', '--output', default=MODEL_PATH)
+    parser.add_argument('--select', action='store_true', help="draw the box regions by hand")
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None:
+        print(f"Error: Could not load image {args.image}")
+        raise SystemExit(1)
+    boxes = {}
+    if args.select:
+        for color in ('red', 'green', 'blue'):
+            boxes[color] = cv2.selectROI(f"Select the {color} box", img)
+        cv2.destroyAllWindows()
+    model = calibrate_from_frame(img, boxes=boxes)
+    if model is not None:
+        model.save(args.output)
+        print(f"Saved {args.output}")
+        for color in model.colors:
+            print(f"{color}: {int(np.count_nonzero(model.mask(img, color)))} pixels")
@@ -1,6 +1,9 @@
 import serial
 import time
 
+# Firmware servo number of each joint (servo 4 is the gripper)
+from trajectory_serial import SERVO_CHANNELS
+
 ser = serial.Serial(
     port='/dev/ttyAMA0',
     baudrate=115200,
@@ -9,17 +12,23 @@ ser = serial.Serial(
     bytesize=serial.EIGHTBITS,
     timeout=1
     )
+
 def remap(angle):
     source_span = 199
     source_min = 0
     target_span = 400
     target_min = 1500
     scale_factor = float(target_span) / float(source_span)
-    remapped_value = target_min + (value - source_min) * scale_factor
+    remapped_value = target_min + (angle - source_min) * scale_factor
     return remapped_value
 
 def command(servo, angle):
     waveform = remap(angle)
     ser.write(bytes([servo]))
     time.sleep(0.1)
-    ser.write(bytes([angle]))
+    ser.write(bytes([int(round(angle))]))
+
+def command_joints(servo_angles):
+    """Send every joint of a servo_angles dict ('joint1', ...) from IK2"""
+    for joint, angle in servo_angles.items():
+        command(SERVO_CHANNELS[joint], angle)
@@ -1,22 +1,86 @@
 import cv2
 import numpy as np
+from typing import Optional, Tuple
+
+# Pixel to mm scale of the rectified image
+PX_TO_MM = 0.86487
+
+# BGR bounds for each box color (these values may need adjustment based on lighting)
+COLOR_RANGES = {
+    'blue': (np.array([200, 170, 110]), np.array([230, 200, 140])),#([100, 100, 100]) #137, 195, 220
+    'green': (np.array([120, 150, 105]), np.array([140, 170, 125])),
+    'red': (np.array([140, 140, 235]), np.array([160, 160, 255])),
+}
+
+# Learned color_model.ColorModel used instead of COLOR_RANGES when set
+COLOR_MODEL = None
+
+def load_color_model(path: str = 'color_model.npz') -> bool:
+    """
+    Use a color model saved by color_model.py for all detections.
+
+    Returns:
+        False if there is no model at path (COLOR_RANGES stay in use)
+    """
+    global COLOR_MODEL
+    import os
+    import color_model
+    if not os.path.exists(path):
+        return False
+    COLOR_MODEL = color_model.ColorModel.load(path)
+    return True
+
+def color_mask(image, color: str, model=None):
+    """
+    Binary mask of the pixels of image that have the given color.
+
+    Args:
+        model: ColorModel to use, None for COLOR_MODEL, False to force
+            COLOR_RANGES
+    """
+    if model is None:
+        model = COLOR_MODEL
+    if model and color in model.colors:
+        return model.mask(image, color)
+    lower, upper = COLOR_RANGES[color]
+    return cv2.inRange(image, lower, upper)
+
+def detect_box(image, color: str, min_area: float = 0.0, model=None) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Find the largest blob of the given color in an image.
+
+    Args:
+        image: BGR image (full frame or ROI)
+        color: 'red', 'green' or 'blue'
+        min_area: Contours smaller than this (pixels) are ignored
+        model: Passed on to color_mask
+
+    Returns:
+        Bounding box (x, y, w, h) in image pixels, or None if nothing found
+    """
+    mask = color_mask(image, color, model)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest_contour = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(largest_contour) < min_area:
+        return None
+    return cv2.boundingRect(largest_contour)
+
 def find_src(red, green, blue):
-    # Define the lower and upper bounds of the color you want to detect in HSV
-    # Example for blue color (these values may need adjustment based on lighting)
-    lower_blue = np.array([200, 170, 110])#([100, 100, 100]) #137, 195, 220
-    upper_blue = np.array([230, 200, 140])#([140, 255, 255])
-    
-    lower_green = np.array([120, 150, 105])
-    upper_green = np.array([140, 170, 125])
-    
-    lower_red = np.array([140, 140, 235])
-    upper_red = np.array([160, 160, 255])
+    # Define the lower and upper bounds of the color you want to detect (BGR)
+    lower_blue, upper_blue = COLOR_RANGES['blue']
+    lower_green, upper_green = COLOR_RANGES['green']
+    lower_red, upper_red = COLOR_RANGES['red']
+    color = 'blue'
     if red:
         lower_blue = lower_red
         upper_blue = upper_red
+        color = 'red'
     if green:
         lower_blue = lower_green
         upper_blue = upper_green
+        color = 'green'
     
     # For a static image:
     image = cv2.imread('rectified_image.png')
@@ -26,7 +90,10 @@ def find_src(red, green, blue):
     cv2.waitKey(0)
     
     # Create a mask for the specified color range
-    mask = cv2.inRange(image, lower_blue, upper_blue)
+    if COLOR_MODEL is not None:
+        mask = color_mask(image, color)
+    else:
+        mask = cv2.inRange(image, lower_blue, upper_blue)
     
     # Find contours in the mask
     # Use the appropriate return values for your OpenCV version
@@ -40,13 +107,13 @@ def find_src(red, green, blue):
         
         # Draw the bounding rectangle on the original image
         cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0), 2)
-        print(f"x: {x*0.86487}, y: {y*0.86487}")
+        print(f"x: {x*PX_TO_MM}, y: {y*PX_TO_MM}")
         cv2.putText(image, "Blue Box", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
         cv2.imshow("Detected Blue Box", image)
         cv2.putText(image, "Blue Box", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
  
         cv2.waitKey(0)
-        return ((x+w/2)*0.86487,(y+h/2)*0.86487)
+        return ((x+w/2)*PX_TO_MM,(y+h/2)*PX_TO_MM)
         cv2.putText(image, "Blue Box", (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
     else:
         print("Image recognition failed!")
@@ -5,10 +5,8 @@ import asyncio
 import detect_color
 import IK2
 robot_arm = IK2.RobotArmIK()
-robot_arm.set_servo_calibration("joint1", 45.0, 1)
-robot_arm.set_servo_calibration("joint2", 45.0, 1)
-robot_arm.set_servo_calibration("joint3", 0.0, 1)
-robot_arm.set_servo_calibration("joint4", 45.0, 1)
+# servo offsets/directions come from servo_autocal.py
+robot_arm.load_config("params.json")
 # get user voice input
 usr_txt = internal_speech.get_speech()
 # get confirmation input is correct
@@ -40,7 +38,10 @@ if "blue" in ai_resp:
 camera_undistort_and_rectify.unr()
 # analyze for the colors
 x, y = detect_color.find_src(red, green, blue)
-robot_arm.inverse_kinematics(x, y, 0)
+# fall back to a shallower grabber angle if straight down is out of reach
+x, y = robot_arm.table_to_arm(x, y)
+ik = robot_arm.inverse_kinematics_relaxed(x, y, 0)
+print(ik)
 # depending on the selected color and destination, have commands
 # move to src
 # grab
@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+import detect_color
+
+
+class GraspVerifier:
+    def __init__(self,
+                 roi_size: int = 48,
+                 picked_fraction: float = 0.3,
+                 placed_fraction: float = 0.5):
+        """
+        Checks picks and placements by comparing small ROIs around the source
+        and destination with reference patches from the pre-pick frame,
+        instead of running the full capture/rectify/detect chain.
+
+        With rectify maps (see remap_cache.rectify_maps) only the ROIs are
+        remapped out of the raw frame; without, frames must already be
+        rectified. The arm has to be clear of the ROI being checked.
+
+        Args:
+            roi_size: ROI side length in rectified pixels
+            picked_fraction: The pick succeeded if the box color covers less
+                than this fraction of the source ROI compared to before
+            placed_fraction: The place succeeded if the box color covers at
+                least this fraction of the destination ROI, compared to how
+                much it covered the source ROI before the pick
+        """
+        self.roi_size = roi_size
+        self.picked_fraction = picked_fraction
+        self.placed_fraction = placed_fraction
+        self.color = None
+        self.maps = None
+        self.source = None          # ROI centers in rectified pixels
+        self.target = None
+        self.source_patch = None    # reference patches from the pre-pick frame
+        self.target_patch = None
+        self.source_coverage = 0.0
+
+    def _center(self, xy_mm) -> Tuple[int, int]:
+        return (int(round(xy_mm[0] / detect_color.PX_TO_MM)), int(round(xy_mm[1] / detect_color.PX_TO_MM)))
+
+    def roi(self, frame: np.ndarray, center: Tuple[int, int]) -> Optional[np.ndarray]:
+        """Rectified roi_size square around center, or None if it is off the image"""
+        if frame is None:
+            return None
+        half = self.roi_size // 2
+        x0, y0 = center[0] - half, center[1] - half
+        x1, y1 = x0 + self.roi_size, y0 + self.roi_size
+        if self.maps is not None:
+            map1, map2 = self.maps
+            if x0 < 0 or y0 < 0 or x1 > map1.shape[1] or y1 > map1.shape[0]:
+                return None
+            return cv2.remap(frame,
+                             np.ascontiguousarray(map1[y0:y1, x0:x1]),
+                             np.ascontiguousarray(map2[y0:y1, x0:x1]),
+                             interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+        if x0 < 0 or y0 < 0 or x1 > frame.shape[1] or y1 > frame.shape[0]:
+            return None
+        return frame[y0:y1, x0:x1]
+
+    def coverage(self, patch: np.ndarray) -> float:
+        """Fraction of the patch with the box color"""
+        return float(np.count_nonzero(detect_color.color_mask(patch, self.color))) / patch.shape[0] / patch.shape[1]
+
+    def reference(self, frame: np.ndarray, color: str, source, target, maps=None) -> bool:
+        """
+        Store the reference patches from the frame taken before the pick.
+
+        Args:
+            frame: Raw frame (or rectified frame if maps is None)
+            color: Box color
+            source, target: (x, y) mm of the box and its destination
+            maps: Raw frame -> rectified view maps, or None
+
+        Returns:
+            False if the box is not visible in the source ROI
+        """
+        self.color = color
+        self.maps = maps
+        self.source = self._center(source)
+        self.target = self._center(target)
+        self.source_patch = self.roi(frame, self.source)
+        self.target_patch = self.roi(frame, self.target)
+        if self.source_patch is None or self.target_patch is None:
+            return False
+        self.source_coverage = self.coverage(self.source_patch)
+        return self.source_coverage > 0
+
+    def _compare(self, frame: np.ndarray, center, reference: np.ndarray) -> Optional[Dict]:
+        patch = self.roi(frame, center)
+        if patch is None:
+            return None
+        return {
+            'coverage': self.coverage(patch),
+            'difference': float(np.mean(cv2.absdiff(patch, reference))) / 255.0
+        }
+
+    def verify_pick(self, frame: np.ndarray) -> Dict:
+        """
+        Check the box has left the source.
+
+        Returns:
+            Dictionary with 'ok', the box color 'coverage' of the source ROI
+            and its mean 'difference' (0-1) from the reference patch
+        """
+        result = self._compare(frame, self.source, self.source_patch)
+        if result is None:
+            return {'ok': False}
+        result['ok'] = result['coverage'] < self.picked_fraction * self.source_coverage
+        return result
+
+    def verify_place(self, frame: np.ndarray) -> Dict:
+        """
+        Check the box arrived at the destination.
+
+        Returns:
+            Same as verify_pick, for the destination ROI
+        """
+        result = self._compare(frame, self.target, self.target_patch)
+        if result is None:
+            return {'ok': False}
+        result['ok'] = result['coverage'] >= self.placed_fraction * self.source_coverage
+        return result
+
+
+# Example usage
+if __name__ == "__main__":
+    import sys
+    import time
+
+    # grasp_verify.py before.png after.png color src_x src_y dst_x dst_y (rectified images, mm)
+    before, after = cv2.imread(sys.argv[1]), cv2.imread(sys.argv[2])
+    color = sys.argv[3]
+    source = (float(sys.argv[4]), float(sys.argv[5]))
+    target = (float(sys.argv[6]), float(sys.argv[7]))
+    verifier = GraspVerifier()
+    if not verifier.reference(before, color, source, target):
+        print(f"No {color} box at {source}")
+    start = time.perf_counter()
+    pick = verifier.verify_pick(after)
+    place = verifier.verify_place(after)
+    print(f"Pick: {pick}")
+    print(f"Place: {place}")
+    print(f"Verified in {(time.perf_counter() - start) * 1000:.2f} ms")
@@ -10,8 +10,10 @@ class Command(BaseModel):
     Source: Literal["red box", "blue box", "green box"]
     Destination: Literal["lower left corner", "lower right corner", "upper left corner", "upper right corner"]
 
-async def ai_cmd(usr_txt):
-    client = AsyncDedalus()
+async def parse_cmd(usr_txt, client=None) -> Command:
+    # pass a client to reuse its connection across commands
+    if client is None:
+        client = AsyncDedalus()
     completion = await client.chat.completions.parse(
         model="openai/gpt-5.2",
         messages=[{
@@ -40,5 +42,8 @@ async def ai_cmd(usr_txt):
         response_format=Command
     )
 
-    parsed = completion.choices[0].message.parsed
+    return completion.choices[0].message.parsed
+
+async def ai_cmd(usr_txt):
+    parsed = await parse_cmd(usr_txt)
     return f"{parsed.Source}:{parsed.Destination}"
@@ -0,0 +1,284 @@
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+import IK2
+import collision_check
+import grasp_verify
+import trajectory_serial
+
+# Gripper servo angles (measure these for your gripper)
+GRIPPER_OPEN = 60.0
+GRIPPER_CLOSED = 120.0
+# Height above the box for the approach/retreat poses (mm)
+HOVER_HEIGHT = 40.0
+# Time to let the gripper open/close (s)
+GRIP_TIME = 0.4
+# Distance the gripper moves away from a placed box before it is checked (mm)
+CLEAR_DISTANCE = 100.0
+# Seen from above as a line from the base to the gripper, the arm must pass
+# at least this far from the box being checked (mm)
+CLEAR_MARGIN = 50.0
+
+
+class PickExecutor:
+    def __init__(self,
+                 arm: IK2.RobotArmIK,
+                 link: trajectory_serial.TrajectoryLink,
+                 checker: Optional[collision_check.CollisionChecker] = None,
+                 joint_speed: float = 60.0,
+                 samples_per_move: int = 20,
+                 verifier: Optional[grasp_verify.GraspVerifier] = None,
+                 frame_source: Optional[Callable] = None,
+                 retries: int = 1):
+        """
+        Turns scheduled PickSteps into checked trajectories for the firmware.
+
+        Args:
+            arm: RobotArmIK used to resolve the hover poses
+            link: TrajectoryLink to the Teensy
+            checker: CollisionChecker every trajectory is validated with
+            joint_speed: Servo speed (degrees/s) used to time the moves
+            samples_per_move: Samples per move for the collision check
+            verifier: GraspVerifier used to check picks and placements
+            frame_source: Returns a (frame, rectify maps) pair captured after
+                it was called, e.g. arm_daemon.VisionLoop.wait_frame
+            retries: Extra pick attempts after a missed grab
+        """
+        self.arm = arm
+        self.link = link
+        self.checker = checker if checker is not None else collision_check.CollisionChecker(arm)
+        self.joint_speed = joint_speed
+        self.samples_per_move = samples_per_move
+        self.verifier = verifier
+        self.frame_source = frame_source
+        self.retries = retries
+        self.servo_angles: Optional[Dict] = None    # last commanded arm pose, None until known
+        self.gripper = GRIPPER_OPEN
+        self.reference = None   # (color, frame, maps) captured before moving toward that box
+
+    def move_time(self, from_servo: Dict, to_servo: Dict) -> float:
+        delta = max(abs(to_servo[j] - from_servo[j]) for j in IK2.JOINTS)
+        return max(delta / self.joint_speed, 0.05)
+
+    def hover_pose(self, xy, current: Optional[Dict] = None) -> Optional[Dict]:
+        """Pose HOVER_HEIGHT above a table position (mm)"""
+        x, y = self.arm.table_to_arm(xy[0], xy[1])
+        result = self.arm.inverse_kinematics_relaxed(x, y, HOVER_HEIGHT, current_servo_angles=current)
+        return None if result is None else result['servo_angles']
+
+    def clear_of(self, gripper_xy, xy) -> bool:
+        """
+        True if the arm, seen from above as a line from the base to the
+        gripper at gripper_xy, passes at least CLEAR_MARGIN from xy (table mm).
+        """
+        base = np.asarray(self.arm.base_position, dtype=float)
+        reach = np.asarray(gripper_xy, dtype=float) - base
+        xy = np.asarray(xy, dtype=float)
+        s = np.clip(np.dot(xy - base, reach) / max(np.dot(reach, reach), 1e-9), 0.0, 1.0)
+        return bool(np.linalg.norm(base + s * reach - xy) >= CLEAR_MARGIN)
+
+    def clear_pose(self, xy) -> Optional[Dict]:
+        """
+        Hover pose CLEAR_DISTANCE from a table position with the arm out of
+        the camera's view of it, preferring to retreat toward the base.
+
+        Returns:
+            servo_angles, or None if no such pose can be reached from the
+            current one without a collision
+        """
+        xy = np.asarray(xy, dtype=float)
+        toward = np.arctan2(self.arm.base_position[1] - xy[1], self.arm.base_position[0] - xy[0])
+        for turn in np.radians([0, 45, -45, 90, -90, 135, -135, 180]):
+            point = xy + CLEAR_DISTANCE * np.array([np.cos(toward + turn), np.sin(toward + turn)])
+            if not self.clear_of(point, xy):
+                continue
+            pose = self.hover_pose(point, self.servo_angles)
+            if pose is not None and self.check(self.segments([(pose, self.gripper)])):
+                return pose
+        return None
+
+    def capture_reference(self, color: str):
+        """
+        Keep a frame from before a move toward the color box (e.g. a
+        speculative one), for the next execute() of that box to use as its
+        verification reference while the arm is over it.
+        """
+        self.reference = None
+        if self.verifier is not None and self.frame_source is not None:
+            frame, maps = self.frame_source()
+            if frame is not None:
+                self.reference = (color, frame, maps)
+
+    def sync_pose(self, telemetry, timeout: float = 1.0) -> bool:
+        """
+        Take the arm pose from the firmware's telemetry, e.g. at startup.
+
+        Args:
+            telemetry: Running TelemetryReader
+            timeout: Time to wait for a report (s)
+
+        Returns:
+            False if no report arrived; the pose then stays unknown
+        """
+        pose = telemetry.servo_angles(after=time.monotonic(), timeout=timeout)
+        if pose is None:
+            return False
+        self.servo_angles, self.gripper = pose
+        return True
+
+    def segments(self, poses: List[Tuple[Dict, float]]) -> List[Tuple[float, np.ndarray, np.ndarray]]:
+        """
+        Firmware segments from the current pose through (servo_angles,
+        gripper) poses, coming to rest at each one so grips and dwells
+        happen standing still and every move follows its straight joint path.
+        """
+        waypoints = [trajectory_serial.servo_vector(self.servo_angles, self.gripper)]
+        times = [0.0]
+        previous, previous_gripper = self.servo_angles, self.gripper
+        for pose, gripper in poses:
+            duration = self.move_time(previous, pose)
+            if gripper != previous_gripper:
+                duration = max(duration, GRIP_TIME)
+            waypoints.append(trajectory_serial.servo_vector(pose, gripper))
+            times.append(times[-1] + duration)
+            previous, previous_gripper = pose, gripper
+        return trajectory_serial.hermite_segments(np.array(waypoints), np.array(times), stops=range(len(times)))
+
+    def check(self, segments) -> bool:
+        """Collision check samples of the path the firmware interpolates through segments"""
+        start = trajectory_serial.servo_vector(self.servo_angles, self.gripper)
+        samples = trajectory_serial.sample_segments(start, segments, self.samples_per_move)
+        if not len(samples):
+            return True
+        channels = [trajectory_serial.SERVO_CHANNELS[j] for j in IK2.JOINTS]
+        return self.checker.is_valid(samples[:, channels], angle_type='servo')
+
+    def run(self, poses: List[Tuple[Dict, float]], wait: bool = True) -> bool:
+        """
+        Send a sequence of (servo_angles, gripper) poses as one trajectory.
+
+        Returns:
+            False if the arm pose is unknown (see sync_pose), or the moves
+            fail the collision check or can't be sent
+        """
+        if self.servo_angles is None:
+            print("Arm pose unknown, not sending a trajectory")
+            return False
+        if not poses:
+            return True
+        segments = self.segments(poses)
+        if not self.check(segments):
+            print("Trajectory rejected by collision check")
+            return False
+        if not self.link.send_segments(segments):
+            return False
+        previous, previous_gripper = poses[-1]
+        self.servo_angles, self.gripper = previous, previous_gripper
+        if wait:
+            return self.link.wait_idle()
+        return True
+
+    def cancel(self, stop_time: float = 0.2, telemetry=None) -> bool:
+        """
+        Abandon all queued motion, easing to a stop over stop_time seconds.
+
+        Args:
+            telemetry: TelemetryReader to find out where the arm stopped;
+                without it (or a report) the pose is unknown and nothing
+                more is sent until sync_pose succeeds
+
+        Returns:
+            False if the arm didn't come to rest or its pose wasn't reported
+        """
+        self.reference = None
+        self.link.cancel(stop_time)
+        ok = self.link.wait_idle()
+        self.servo_angles = None
+        if telemetry is None or not self.sync_pose(telemetry):
+            return False
+        return ok
+
+    def pick(self, source, source_servo: Dict, wait: bool = True) -> bool:
+        """Approach from above, grab and lift"""
+        hover = self.hover_pose(source, source_servo)
+        if hover is None:
+            return False
+        return self.run([
+            (hover, GRIPPER_OPEN),
+            (source_servo, GRIPPER_OPEN),
+            (source_servo, GRIPPER_CLOSED),
+            (hover, GRIPPER_CLOSED),
+        ], wait)
+
+    def place(self, target, target_servo: Dict, wait: bool = True) -> bool:
+        """Move above the target, lower, release and lift"""
+        hover = self.hover_pose(target, target_servo)
+        if hover is None:
+            return False
+        return self.run([
+            (hover, GRIPPER_CLOSED),
+            (target_servo, GRIPPER_CLOSED),
+            (target_servo, GRIPPER_OPEN),
+            (hover, GRIPPER_OPEN),
+        ], wait)
+
+    def execute(self, step) -> bool:
+        """
+        Run a scheduler.PickStep.
+
+        With a verifier, the pick is checked once the arm is clear of the
+        source (over the target if that is, else at clear_pose) and retried
+        on a missed grab, and the place is checked once the arm has moved
+        clear of the target.
+        The pick is compared against the frame from capture_reference() if
+        it was for this box, since the arm may already be over it.
+        """
+        source_servo = step.source_ik['servo_angles']
+        target_servo = step.target_ik['servo_angles']
+        if self.verifier is None or self.frame_source is None:
+            return self.pick(step.source, source_servo) and self.place(step.target, target_servo)
+
+        reference, self.reference = self.reference, None
+        if reference is not None and reference[0] == step.job.color:
+            frame, maps = reference[1:]
+        else:
+            frame, maps = self.frame_source()
+        if not self.verifier.reference(frame, step.job.color, step.source, step.target, maps):
+            print(f"No {step.job.color} box at the source")
+            return False
+        target_hover = self.hover_pose(step.target, target_servo)
+        if target_hover is None:
+            return False
+        for attempt in range(self.retries + 1):
+            if not self.pick(step.source, source_servo):
+                return False
+            # A missed grab only shows if the arm doesn't hide the source
+            if self.clear_of(step.target, step.source):
+                check_pose = target_hover
+            else:
+                check_pose = self.clear_pose(step.source)
+            if check_pose is None:
+                print(f"No pose clear of the source to check the {step.job.color} pick from")
+                return False
+            if not self.run([(check_pose, GRIPPER_CLOSED)]):
+                return False
+            frame, maps = self.frame_source()
+            if self.verifier.verify_pick(frame)['ok']:
+                break
+            print(f"Missed the {step.job.color} box (attempt {attempt + 1})")
+        else:
+            return False
+        if not self.place(step.target, target_servo):
+            return False
+        clear = self.clear_pose(step.target)
+        if clear is None:
+            print(f"No pose clear of the target to check the {step.job.color} box from")
+            return False
+        if not self.run([(clear, GRIPPER_OPEN)]):
+            return False
+        frame, maps = self.frame_source()
+        result = self.verifier.verify_place(frame)
+        if not result['ok']:
+            print(f"The {step.job.color} box is not at the target: {result}")
+        return result['ok']
@@ -0,0 +1,147 @@
+import glob
+import hashlib
+import os
+import cv2
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+# Maps are stored here as <kind>_<key>_map1.npy / _map2.npy
+CACHE_DIR = 'remap_cache'
+
+# Map sets of each kind kept on disk, older ones are deleted
+KEEP = 4
+
+# Maps already opened by this process, at most KEEP of each kind
+_loaded: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+
+def calibration_key(*arrays, size: Tuple[int, int]) -> str:
+    """Hash of the calibration arrays and image size, changes with either"""
+    h = hashlib.sha1()
+    for a in arrays:
+        h.update(np.ascontiguousarray(a, dtype=np.float64).tobytes())
+    h.update(np.array(size, dtype=np.int64).tobytes())
+    return h.hexdigest()[:16]
+
+
+def _paths(cache_dir: str, kind: str, key: str):
+    base = os.path.join(cache_dir, f"{kind}_{key}")
+    return base + '_map1.npy', base + '_map2.npy'
+
+
+def _load_or_build(kind: str, key: str, build, cache_dir: str):
+    """
+    Memory-map cached maps, building and saving them first if needed.
+    Only the KEEP most recently built maps of each kind are kept.
+    """
+    path1, path2 = _paths(cache_dir, kind, key)
+    if path1 in _loaded:
+        # Most recently used last
+        _loaded[path1] = _loaded.pop(path1)
+        return _loaded[path1]
+    if not (os.path.exists(path1) and os.path.exists(path2)):
+        map1, map2 = build()
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary name first so other processes never see half a file
+        for path, m in ((path1, map1), (path2, map2)):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, m)
+            os.replace(tmp, path)
+        # Maps for old calibrations or resolutions
+        built = sorted(glob.glob(os.path.join(cache_dir, f"{kind}_*_map1.npy")), key=os.path.getmtime)
+        for stale in built[:-KEEP]:
+            for path in _paths(cache_dir, kind, os.path.basename(stale)[len(kind) + 1:-len('_map1.npy')]):
+                if os.path.exists(path):
+                    os.remove(path)
+            _loaded.pop(stale, None)
+    maps = (np.load(path1, mmap_mode='r'), np.load(path2, mmap_mode='r'))
+    _loaded[path1] = maps
+    same_kind = [path for path in _loaded if os.path.basename(path).startswith(kind + '_')]
+    for path in same_kind[:-KEEP]:
+        del _loaded[path]
+    return maps
+
+
+def undistort_maps(K: np.ndarray, D: np.ndarray, size: Tuple[int, int], new_K: np.ndarray,
+                   cache_dir: str = CACHE_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fisheye undistortion maps for cv2.remap.
+
+    Args:
+        K, D: Fisheye calibration
+        size: (width, height) of the images
+        new_K: Camera matrix of the undistorted image
+
+    Returns:
+        (map1, map2) in CV_16SC2 format, memory-mapped read-only
+    """
+    key = calibration_key(K, D, new_K, size=size)
+
+    def build():
+        return cv2.fisheye.initUndistortRectifyMap(K, D, np.eye(3), new_K, size, cv2.CV_16SC2)
+
+    return _load_or_build('undistort', key, build, cache_dir)
+
+
+def rectify_maps(H: np.ndarray, K: np.ndarray, D: np.ndarray, size: Tuple[int, int], new_K: np.ndarray,
+                 out_size: Optional[Tuple[int, int]] = None,
+                 cache_dir: str = CACHE_DIR) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maps taking a raw camera frame straight to the rectified view, i.e.
+    undistortion with new_K followed by the homography H, in one cv2.remap.
+
+    Args:
+        H: Homography from the undistorted image to the rectified view
+        K, D: Fisheye calibration
+        size: (width, height) of the raw frames
+        new_K: Camera matrix of the undistorted image H was found in
+        out_size: (width, height) of the rectified view, defaults to size
+
+    Returns:
+        (map1, map2) in CV_16SC2 format, memory-mapped read-only
+    """
+    if out_size is None:
+        out_size = size
+    key = calibration_key(K, D, new_K, H, np.array(out_size), size=size)
+
+    def build():
+        w, h = out_size
+        xs, ys = np.meshgrid(np.arange(w, dtype=np.float64), np.arange(h, dtype=np.float64))
+        out = np.stack([xs.ravel(), ys.ravel(), np.ones(w * h)])
+        # Rectified pixel -> undistorted pixel -> normalized camera ray
+        undistorted = np.linalg.inv(H) @ out
+        behind = undistorted[2] <= 0
+        rays = np.linalg.inv(new_K) @ undistorted
+        rays = (rays[:2] / rays[2]).T.reshape(1, -1, 2)
+        # -> raw (distorted) pixel
+        src = cv2.fisheye.distortPoints(rays, K, D).reshape(h, w, 2).astype(np.float32)
+        src.reshape(-1, 2)[behind] = -1
+        return cv2.convertMaps(src, None, cv2.CV_16SC2)
+
+    return _load_or_build('rectify', key, build, cache_dir)
+
+
+def corner_shift(H1: np.ndarray, H2: np.ndarray, size: Tuple[int, int]) -> float:
+    """Largest distance (pixels) the image corners move between two homographies"""
+    w, h = size
+    corners = np.array([[[0, 0], [w, 0], [w, h], [0, h]]], dtype=np.float64)
+    a = cv2.perspectiveTransform(corners, H1)[0]
+    b = cv2.perspectiveTransform(corners, H2)[0]
+    return float(np.max(np.linalg.norm(a - b, axis=1)))
+
+
+def remap(image: np.ndarray, maps: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    return cv2.remap(image, maps[0], maps[1], interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+
+# Example usage
+if __name__ == "__main__":
+    import time
+    import camera_disp_undistort
+
+    size = (camera_disp_undistort.IMG_WIDTH, camera_disp_undistort.IMG_HEIGHT)
+    start = time.perf_counter()
+    maps = undistort_maps(camera_disp_undistort.K, camera_disp_undistort.D, size,
+                          camera_disp_undistort.new_camera_matrix())
+    print(f"Undistortion maps ready in {(time.perf_counter() - start) * 1000:.1f} ms ({maps[0].filename})")
@@ -0,0 +1,252 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+import IK2
+
+# Destination corners in mm, same frame as the detect_color positions
+# (measure these for your table; they must be within the arm's reach,
+# see RobotArmIK.table_to_arm)
+CORNERS = {
+    'upper left corner': (100.0, 100.0),
+    'upper right corner': (320.0, 100.0),
+    'lower left corner': (100.0, 280.0),
+    'lower right corner': (320.0, 280.0)
+}
+
+
+class PickJob:
+    """One pick-and-place request, built from a not_slop.Command"""
+    def __init__(self, command, index: int):
+        self.command = command
+        self.index = index                                  # arrival order
+        self.color = command.Source.replace(' box', '')     # 'red box' -> 'red'
+        self.destination = command.Destination
+
+    def __repr__(self):
+        return f"PickJob({self.index}: {self.color} -> {self.destination})"
+
+
+class PickStep:
+    """A scheduled job with its resolved poses"""
+    def __init__(self, job: PickJob, source, target, source_ik: Dict, target_ik: Dict, travel_time: float):
+        self.job = job
+        self.source = source            # (x, y) mm
+        self.target = target            # (x, y) mm
+        self.source_ik = source_ik
+        self.target_ik = target_ik
+        self.travel_time = travel_time  # arm travel for this step (s)
+
+    def __repr__(self):
+        return f"PickStep({self.job}, {self.travel_time:.2f}s)"
+
+
+class PickScheduler:
+    def __init__(self,
+                 arm: IK2.RobotArmIK,
+                 corners: Dict = None,
+                 joint_speed: float = 60.0,
+                 occupied_radius: float = 30.0,
+                 exhaustive_limit: int = 7):
+        """
+        Orders batches of pick-and-place jobs to minimize arm travel time.
+
+        Orders are searched with branch and bound (greedy nearest job for
+        batches larger than exhaustive_limit) while simulating where each box
+        ends up, so a job only runs once its destination corner is free and
+        jobs moving the same box keep their arrival order.
+
+        Args:
+            arm: RobotArmIK used to resolve poses
+            corners: Destination name -> (x, y) mm, defaults to CORNERS
+            joint_speed: Servo speed (degrees/s) used to estimate travel time
+            occupied_radius: A box closer than this (mm) to a corner occupies it
+            exhaustive_limit: Largest batch searched exhaustively
+        """
+        self.arm = arm
+        self.corners = CORNERS if corners is None else corners
+        self.joint_speed = joint_speed
+        self.occupied_radius = occupied_radius
+        self.exhaustive_limit = exhaustive_limit
+        self.jobs: List[PickJob] = []
+        self._next_index = 0
+        self._ik_cache = {}
+
+    def add(self, command) -> PickJob:
+        """Queue one not_slop.Command"""
+        if command.Destination not in self.corners:
+            raise ValueError(f"Unknown destination: {command.Destination}")
+        job = PickJob(command, self._next_index)
+        self._next_index += 1
+        self.jobs.append(job)
+        return job
+
+    def add_batch(self, commands) -> List[PickJob]:
+        return [self.add(command) for command in commands]
+
+    def _ik(self, xy, pose: Optional[Dict]) -> Optional[Dict]:
+        """IK for a table position, on the branch nearest pose"""
+        key = (round(xy[0], 1), round(xy[1], 1),
+               None if pose is None else tuple(round(pose[j], 1) for j in IK2.JOINTS))
+        if key not in self._ik_cache:
+            x, y = self.arm.table_to_arm(xy[0], xy[1])
+            self._ik_cache[key] = self.arm.inverse_kinematics_relaxed(x, y, 0, current_servo_angles=pose)
+        return self._ik_cache[key]
+
+    def travel_time(self, from_servo: Optional[Dict], to_servo: Dict) -> float:
+        """Time for a joint move, set by the joint that moves furthest"""
+        if from_servo is None:
+            return 0.0
+        delta = max(abs(to_servo[j] - from_servo[j]) for j in IK2.JOINTS)
+        return delta / self.joint_speed
+
+    def _corner_free(self, corner: str, positions: Dict, moving: str) -> bool:
+        cx, cy = self.corners[corner]
+        for color, (x, y) in positions.items():
+            if color != moving and np.hypot(x - cx, y - cy) < self.occupied_radius:
+                return False
+        return True
+
+    def _step(self, job: PickJob, positions: Dict, pose: Optional[Dict]) -> Optional[PickStep]:
+        """Resolve a job from the current simulated state, or None if it can't run now"""
+        if job.color not in positions:
+            return None
+        if not self._corner_free(job.destination, positions, job.color):
+            return None
+        source = positions[job.color]
+        target = self.corners[job.destination]
+        source_ik = self._ik(source, pose)
+        if source_ik is None:
+            return None
+        target_ik = self._ik(target, source_ik['servo_angles'])
+        if target_ik is None:
+            return None
+        travel = (self.travel_time(pose, source_ik['servo_angles'])
+                  + self.travel_time(source_ik['servo_angles'], target_ik['servo_angles']))
+        return PickStep(job, source, target, source_ik, target_ik, travel)
+
+    def _ready(self, remaining: List[PickJob]) -> List[PickJob]:
+        """Jobs whose earlier-arriving jobs for the same box are done"""
+        first = {}
+        for job in remaining:
+            if job.color not in first or job.index < first[job.color].index:
+                first[job.color] = job
+        return [job for job in remaining if first[job.color] is job]
+
+    def _search(self, remaining, positions, pose, steps, cost, best):
+        """
+        Branch and bound over job orders.
+
+        best holds the best order found so far: most jobs first, then the
+        least travel time.
+        """
+        extended = False
+        for job in self._ready(remaining):
+            step = self._step(job, positions, pose)
+            if step is None:
+                continue
+            extended = True
+            new_cost = cost + step.travel_time
+            # Can't beat the best order: no more jobs possible and already slower
+            if len(steps) + len(remaining) <= best['count'] and new_cost >= best['cost']:
+                continue
+            next_positions = dict(positions)
+            next_positions[job.color] = step.target
+            rest = [j for j in remaining if j is not job]
+            self._search(rest, next_positions, step.target_ik['servo_angles'], steps + [step], new_cost, best)
+        if not extended:
+            if len(steps) > best['count'] or (len(steps) == best['count'] and cost < best['cost']):
+                best['count'] = len(steps)
+                best['cost'] = cost
+                best['steps'] = steps
+
+    def _greedy(self, remaining, positions, pose):
+        steps = []
+        remaining = list(remaining)
+        while remaining:
+            candidates = [s for s in (self._step(j, positions, pose) for j in self._ready(remaining)) if s]
+            if not candidates:
+                break
+            step = min(candidates, key=lambda s: s.travel_time)
+            steps.append(step)
+            remaining.remove(step.job)
+            positions = dict(positions)
+            positions[step.job.color] = step.target
+            pose = step.target_ik['servo_angles']
+        return steps
+
+    def plan(self, box_positions: Dict, current_servo_angles: Optional[Dict] = None) -> Dict:
+        """
+        Order the queued jobs.
+
+        Jobs that can never run (box not seen, unreachable, or destination
+        blocked by a box that no job moves) are returned as blocked.
+
+        Args:
+            box_positions: color -> (x, y) mm, e.g. from BoxTracker.positions()
+            current_servo_angles: Current arm pose, or None
+
+        Returns:
+            Dictionary with 'steps' (PickSteps in execution order), 'blocked'
+            (PickJobs), 'travel_time' and 'arrival_order_time' (s), the
+            travel time of running the same jobs in arrival order
+        """
+        jobs = list(self.jobs)
+        # Solutions depend on the poses reached in this plan only
+        self._ik_cache = {}
+        if len(jobs) <= self.exhaustive_limit:
+            best = {'count': -1, 'cost': np.inf, 'steps': []}
+            self._search(jobs, dict(box_positions), current_servo_angles, [], 0.0, best)
+            steps = best['steps']
+        else:
+            steps = self._greedy(jobs, dict(box_positions), current_servo_angles)
+
+        scheduled = {id(s.job) for s in steps}
+        blocked = [job for job in jobs if id(job) not in scheduled]
+
+        # Reference: same scheduled jobs in arrival order
+        arrival_time = 0.0
+        positions = dict(box_positions)
+        pose = current_servo_angles
+        for job in sorted((s.job for s in steps), key=lambda j: j.index):
+            step = self._step(job, positions, pose)
+            if step is None:
+                arrival_time = np.inf
+                break
+            arrival_time += step.travel_time
+            positions[job.color] = step.target
+            pose = step.target_ik['servo_angles']
+
+        return {
+            'steps': steps,
+            'blocked': blocked,
+            'travel_time': float(sum(s.travel_time for s in steps)),
+            'arrival_order_time': float(arrival_time)
+        }
+
+    def clear(self):
+        self.jobs = []
+
+    def pop(self, steps: List[PickStep]):
+        """Remove executed jobs from the queue"""
+        done = {id(s.job) for s in steps}
+        self.jobs = [job for job in self.jobs if id(job) not in done]
+
+
+# Example usage
+if __name__ == "__main__":
+    from types import SimpleNamespace
+
+    arm = IK2.RobotArmIK()
+    arm.load_config('params.json')
+    scheduler = PickScheduler(arm)
+    scheduler.add_batch([
+        SimpleNamespace(Source='red box', Destination='upper right corner'),
+        SimpleNamespace(Source='blue box', Destination='lower left corner'),
+        SimpleNamespace(Source='green box', Destination='upper left corner'),
+    ])
+    boxes = {'red': (200.0, 150.0), 'blue': (150.0, 250.0), 'green': (300.0, 250.0)}
+    plan = scheduler.plan(boxes)
+    for step in plan['steps']:
+        print(step)
+    print(f"Blocked: {plan['blocked']}")
+    print(f"Travel {plan['travel_time']:.2f}s vs {plan['arrival_order_time']:.2f}s in arrival order")
@@ -0,0 +1,373 @@
+import itertools
+import time
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+import IK2
+
+# Length parameters that can optionally be refined, in RobotArmIK attribute names
+LENGTHS = ('h_base', 'L1', 'L2', 'L3')
+
+
+def rodrigues(rvec: np.ndarray) -> np.ndarray:
+    """Rotation matrix from an axis-angle vector"""
+    angle = np.linalg.norm(rvec)
+    if angle < 1e-12:
+        return np.eye(3)
+    k = rvec / angle
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + np.sin(angle) * K + (1 - np.cos(angle)) * (K @ K)
+
+
+def rigid_align(src: np.ndarray, dst: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Least-squares rotation R and translation t with dst ~ R @ src + t (Kabsch).
+
+    Args:
+        src, dst: Arrays of shape (N, 3)
+    """
+    src_mean = src.mean(axis=0)
+    dst_mean = dst.mean(axis=0)
+    H = (src - src_mean).T @ (dst - dst_mean)
+    U, _, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(Vt.T @ U.T))
+    R = Vt.T @ np.diag([1.0, 1.0, d]) @ U.T
+    return R, dst_mean - R @ src_mean
+
+
+def axis_angle(R: np.ndarray) -> np.ndarray:
+    """Axis-angle vector of a rotation matrix"""
+    angle = np.arccos(np.clip((np.trace(R) - 1) / 2, -1.0, 1.0))
+    if angle < 1e-12:
+        return np.zeros(3)
+    v = np.array([R[2, 1] - R[1, 2], R[0, 2] - R[2, 0], R[1, 0] - R[0, 1]])
+    return v * angle / (2 * np.sin(angle))
+
+
+class ServoCalibrationFit:
+    def __init__(self, arm: IK2.RobotArmIK, fit_lengths: bool = False,
+                 tag_offset=(0.0, 0.0, 0.0), fit_tag_offset: bool = False):
+        """
+        Least-squares fit of servo offsets/directions (and optionally link
+        lengths) from observed gripper positions.
+
+        The model is p_camera = R @ (FK(servo_angles) + G @ tag_offset) + t,
+        where G is the gripper frame. Offsets and lengths
+        are continuous and solved with Levenberg-Marquardt; every combination
+        of servo directions is tried and the best fit kept.
+
+        Without a known base pose the camera pose (R, t) is fitted too, and it
+        absorbs any base rotation and height: the joint1 offset, direction
+        and h_base are then kept at their current values.
+
+        The tag offset is where the tag sits relative to the grabber tip:
+        along the tool axis, perpendicular to it in the arm's vertical plane,
+        and sideways (mm). The first two can't be told apart from the joint4
+        offset and L3 by tag positions alone, so they have to be measured;
+        only the sideways component can be fitted.
+
+        Args:
+            arm: RobotArmIK providing the initial guess (it is not modified)
+            fit_lengths: Also refine the link lengths
+            tag_offset: Measured tag offset in the gripper frame (mm)
+            fit_tag_offset: Also fit the sideways tag offset
+        """
+        self.arm = arm
+        self.fit_lengths = fit_lengths
+        self.tag_offset = np.asarray(tag_offset, dtype=float)
+        self.fit_tag_offset = fit_tag_offset
+
+    # Parameter vector: 4 offsets, 3 rotation, 3 translation, 4 lengths, 3 tag offset
+    def _model(self, params: np.ndarray, servo: np.ndarray, directions: np.ndarray) -> np.ndarray:
+        model_arm = IK2.RobotArmIK()
+        model_arm.h_base, model_arm.L1, model_arm.L2, model_arm.L3 = params[10:14]
+        world = (servo - params[0:4]) / directions
+        tip = model_arm.forward_kinematics_batch(world)[:, -1]
+        theta = np.deg2rad(world)
+        yaw = theta[:, 0]
+        pitch = theta[:, 1] + theta[:, 2] + theta[:, 3]
+        # Gripper frame: tool axis, normal in the vertical plane, sideways
+        tool = np.stack([np.cos(pitch) * np.cos(yaw), np.cos(pitch) * np.sin(yaw), np.sin(pitch)], axis=1)
+        normal = np.stack([-np.sin(pitch) * np.cos(yaw), -np.sin(pitch) * np.sin(yaw), np.cos(pitch)], axis=1)
+        side = np.stack([-np.sin(yaw), np.cos(yaw), np.zeros_like(yaw)], axis=1)
+        offset = params[14:17]
+        tag = tip + offset[0] * tool + offset[1] * normal + offset[2] * side
+        return tag @ rodrigues(params[4:7]).T + params[7:10]
+
+    def _levenberg_marquardt(self, params, free, servo, observed, directions,
+                             iterations: int = 100, tol: float = 1e-9) -> Tuple[np.ndarray, float]:
+        def residuals(p):
+            return (self._model(p, servo, directions) - observed).ravel()
+
+        lam = 1e-3
+        r = residuals(params)
+        cost = float(r @ r)
+        for _ in range(iterations):
+            # Forward-difference Jacobian, one column per free parameter
+            J = np.empty((r.size, free.size))
+            for col, i in enumerate(free):
+                step = 1e-6 * max(1.0, abs(params[i]))
+                p = params.copy()
+                p[i] += step
+                J[:, col] = (residuals(p) - r) / step
+            A = J.T @ J
+            g = J.T @ r
+            improved = False
+            while lam < 1e10:
+                candidate = params.copy()
+                candidate[free] += np.linalg.solve(A + lam * np.diag(np.diag(A) + 1e-12), -g)
+                r_new = residuals(candidate)
+                cost_new = float(r_new @ r_new)
+                if cost_new < cost:
+                    improved = True
+                    break
+                lam *= 10
+            if not improved:
+                break
+            converged = cost - cost_new < tol * max(cost, 1.0)
+            params, r, cost = candidate, r_new, cost_new
+            lam = max(lam / 10, 1e-12)
+            if converged:
+                break
+        return params, cost
+
+    def fit(self, servo_angles: np.ndarray, observed: np.ndarray,
+            base_pose: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict:
+        """
+        Fit the calibration.
+
+        Args:
+            servo_angles: Array of shape (N, 4) of commanded servo angles
+            observed: Array of shape (N, 3) of observed gripper positions (mm, camera frame)
+            base_pose: Optional (R, t) of the robot base frame in the camera
+                       frame (e.g. from a tag on the base); makes joint1
+                       and h_base observable
+
+        Returns:
+            Dictionary with 'servo_config', 'lengths' (or None), 'tag_offset',
+            'camera_R', 'camera_t' and 'rms' (mm)
+        """
+        servo = np.asarray(servo_angles, dtype=float)
+        observed = np.asarray(observed, dtype=float)
+        if servo.shape[0] < 6:
+            raise ValueError("Need at least 6 observed poses to calibrate")
+
+        offsets = [self.arm.servo_config[j]['offset'] for j in IK2.JOINTS]
+        lengths = [getattr(self.arm, n) for n in LENGTHS]
+        init = np.array(offsets + [0.0] * 6 + lengths + list(self.tag_offset), dtype=float)
+
+        if base_pose is not None:
+            init[4:7] = axis_angle(np.asarray(base_pose[0], dtype=float))
+            init[7:10] = np.asarray(base_pose[1], dtype=float).ravel()
+            free = [0, 1, 2, 3] + ([10, 11, 12, 13] if self.fit_lengths else [])
+        else:
+            free = [1, 2, 3, 4, 5, 6, 7, 8, 9] + ([11, 12, 13] if self.fit_lengths else [])
+        if self.fit_tag_offset:
+            free.append(16)
+        free = np.array(free)
+
+        if base_pose is not None:
+            combinations = itertools.product((1, -1), repeat=4)
+        else:
+            # Flipping every direction at once looks the same from the camera
+            joint1_direction = self.arm.servo_config['joint1']['direction']
+            combinations = ((joint1_direction,) + d for d in itertools.product((1, -1), repeat=3))
+
+        best = None
+        for directions in combinations:
+            directions = np.array(directions, dtype=float)
+            start = init.copy()
+            if base_pose is None:
+                # Start the camera pose from a rigid alignment of the initial guess
+                R, t = rigid_align(self._model(start, servo, directions), observed)
+                start[4:7] = axis_angle(R)
+                start[7:10] = t
+            params, cost = self._levenberg_marquardt(start, free, servo, observed, directions)
+            # Mirrored solutions fit equally well: prefer the one closest to the current calibration
+            change = np.sum(np.abs((params[0:4] - init[0:4] + 180.0) % 360.0 - 180.0))
+            if best is None or cost < best[1] - 1e-6 * max(best[1], 1.0) or (
+                    cost <= best[1] + 1e-6 * max(best[1], 1.0) and change < best[3]):
+                best = (params, cost, directions, change)
+
+        params, cost, directions, _ = best
+        return {
+            'servo_config': {
+                joint: {'offset': float(params[i]), 'direction': int(directions[i])}
+                for i, joint in enumerate(IK2.JOINTS)
+            },
+            'lengths': dict(zip(LENGTHS, map(float, params[10:14]))) if self.fit_lengths else None,
+            'tag_offset': params[14:17],
+            'camera_R': rodrigues(params[4:7]),
+            'camera_t': params[7:10],
+            'rms': float(np.sqrt(cost / servo.shape[0]))
+        }
+
+
+def calibration_poses(arm: IK2.RobotArmIK, count: int = 24, margin: float = 15.0, seed: int = 0) -> np.ndarray:
+    """
+    Random servo poses spread over the servo range.
+
+    Poses that the collision checker rejects with the current calibration
+    are dropped, so the arm stays clear of the table even if the current
+    offsets are only roughly right.
+
+    Returns:
+        Array of shape (M, 4) of servo angles, M <= count
+    """
+    import collision_check
+
+    rng = np.random.default_rng(seed)
+    limits = np.array([arm.servo_limits[j] for j in IK2.JOINTS])
+    low = limits[:, 0] + margin
+    high = limits[:, 1] - margin
+    candidates = rng.uniform(low, high, size=(count * 10, 4))
+    checker = collision_check.CollisionChecker(arm, table_margin=30.0)
+    ok = checker.check(candidates, angle_type='servo')['ok']
+    return candidates[ok][:count]
+
+
+class TagObserver:
+    def __init__(self, tag_id: int, tag_size_mm: float, camera_index: int = 0, tag_family: str = 'tag36h11'):
+        """
+        Measures the 3D position of the AprilTag mounted on the gripper.
+
+        Args:
+            tag_id: ID of the gripper tag
+            tag_size_mm: Side length of the tag's black square (mm)
+            camera_index: OpenCV camera index
+            tag_family: AprilTag family
+        """
+        import cv2
+        from pupil_apriltags import Detector
+        import camera_disp_undistort
+
+        self.cv2 = cv2
+        self.camera_disp_undistort = camera_disp_undistort
+        self.tag_id = tag_id
+        self.tag_size_mm = tag_size_mm
+        self.K = camera_disp_undistort.K
+        self.D = camera_disp_undistort.D
+        self.new_K = camera_disp_undistort.new_camera_matrix()
+        self.detector = Detector(
+                families=tag_family,
+                nthreads=1,
+                quad_decimate=1.0,
+                quad_sigma=0.0,
+                refine_edges=1,
+                decode_sharpening=0.25,
+                debug=0)
+        self.cap = cv2.VideoCapture(camera_index)
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, camera_disp_undistort.IMG_WIDTH)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, camera_disp_undistort.IMG_HEIGHT)
+
+    def observe(self, samples: int = 3) -> Optional[np.ndarray]:
+        """
+        Tag position in the camera frame (mm), averaged over a few frames.
+
+        Returns:
+            (x, y, z) array, or None if the tag was not seen
+        """
+        cv2 = self.cv2
+        camera_params = (self.new_K[0, 0], self.new_K[1, 1], self.new_K[0, 2], self.new_K[1, 2])
+        positions = []
+        for _ in range(samples):
+            ret, frame = self.cap.read()
+            if not ret:
+                print("Error: Failed to capture image.")
+                continue
+            undistorted = self.camera_disp_undistort.undistort_frame(frame, self.new_K)
+            gray = cv2.cvtColor(undistorted, cv2.COLOR_BGR2GRAY)
+            results = self.detector.detect(gray, estimate_tag_pose=True,
+                                           camera_params=camera_params,
+                                           tag_size=self.tag_size_mm / 1000.0)
+            for tag in results:
+                if tag.tag_id == self.tag_id:
+                    positions.append(tag.pose_t.ravel() * 1000.0)
+        if not positions:
+            return None
+        return np.mean(positions, axis=0)
+
+    def close(self):
+        self.cap.release()
+
+
+def run_calibration(arm: IK2.RobotArmIK,
+                    observer: TagObserver,
+                    poses: np.ndarray,
+                    settle_time: float = 1.0,
+                    fit_lengths: bool = False,
+                    base_pose: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                    tag_offset=(0.0, 0.0, 0.0),
+                    fit_tag_offset: bool = False) -> Optional[Dict]:
+    """
+    Drive the arm through poses, observe the gripper tag and fit the calibration.
+
+    See ServoCalibrationFit for tag_offset and ServoCalibrationFit.fit for base_pose.
+
+    Returns:
+        Fit result (see ServoCalibrationFit.fit), or None if too few poses were seen
+    """
+    import command_serial
+
+    commanded = []
+    observed = []
+    for i, pose in enumerate(poses):
+        command_serial.command_joints(dict(zip(IK2.JOINTS, pose)))
+        time.sleep(settle_time)
+        position = observer.observe()
+        if position is None:
+            print(f"Pose {i + 1}/{len(poses)}: tag not visible, skipping")
+            continue
+        print(f"Pose {i + 1}/{len(poses)}: tag at {np.round(position, 1)}")
+        # The firmware only takes whole angles
+        commanded.append(np.round(pose))
+        observed.append(position)
+
+    if len(observed) < 6:
+        print(f"Calibration failed: only {len(observed)} poses observed")
+        return None
+    fitter = ServoCalibrationFit(arm, fit_lengths, tag_offset, fit_tag_offset)
+    return fitter.fit(np.array(commanded), np.array(observed), base_pose)
+
+
+def apply_fit(arm: IK2.RobotArmIK, result: Dict):
+    """Copy a fit result into a RobotArmIK"""
+    for joint, config in result['servo_config'].items():
+        arm.set_servo_calibration(joint, config['offset'], config['direction'])
+    if result['lengths'] is not None:
+        for name, value in result['lengths'].items():
+            setattr(arm, name, value)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Automatic servo offset/direction calibration")
+    parser.add_argument('--config', default='params.json')
+    parser.add_argument('--tag-id', type=int, default=1)
+    parser.add_argument('--tag-size', type=float, default=30.0, help="gripper tag size in mm")
+    parser.add_argument('--poses', type=int, default=24)
+    parser.add_argument('--fit-lengths', action='store_true')
+    parser.add_argument('--tag-offset', type=float, nargs=3, default=(0.0, 0.0, 0.0),
+                        metavar=('ALONG', 'NORMAL', 'SIDE'),
+                        help="tag center relative to the grabber tip in the gripper frame (mm)")
+    parser.add_argument('--fit-tag-offset', action='store_true', help="fit the sideways tag offset")
+    args = parser.parse_args()
+
+    arm = IK2.RobotArmIK()
+    arm.load_config(args.config)
+    observer = TagObserver(args.tag_id, args.tag_size)
+    try:
+        result = run_calibration(arm, observer, calibration_poses(arm, args.poses), fit_lengths=args.fit_lengths,
+                                 tag_offset=args.tag_offset, fit_tag_offset=args.fit_tag_offset)
+    finally:
+        observer.close()
+
+    if result:
+        print(f"RMS error: {result['rms']:.2f} mm")
+        print(f"Tag offset: {np.round(result['tag_offset'], 1)} mm")
+        for joint, config in result['servo_config'].items():
+            print(f"  {joint}: offset={config['offset']:.2f}°, direction={config['direction']}")
+        apply_fit(arm, result)
+        arm.save_config(args.config)
+        print(f"Wrote calibration to {args.config}")
@@ -0,0 +1,298 @@
+import json
+import os
+import struct
+import threading
+import time
+import numpy as np
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Record types
+FRAME = 1           # raw camera frame
+DETECTION = 2       # detected box positions
+COMMAND = 3         # resolved not_slop.Command
+IK = 4              # IK result
+SERIAL_TX = 5       # bytes sent to the Teensy
+SERIAL_RX = 6       # bytes received from the Teensy
+EVENT = 7           # anything else (e.g. pick result)
+
+RECORD_NAMES = {
+    FRAME: 'frame',
+    DETECTION: 'detection',
+    COMMAND: 'command',
+    IK: 'ik',
+    SERIAL_TX: 'serial_tx',
+    SERIAL_RX: 'serial_rx',
+    EVENT: 'event'
+}
+
+MAGIC = b'85WLOG1\n'
+# type, pad, payload length, timestamp
+RECORD_HEADER = struct.Struct('<B3xId')
+# height, width, channels, pad
+FRAME_HEADER = struct.Struct('<HHHxx')
+
+INDEX_DTYPE = np.dtype([
+    ('type', 'u1'),
+    ('time', 'f8'),
+    ('offset', 'u8'),   # payload offset in the log file
+    ('length', 'u4')    # payload length
+])
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    raise TypeError(f"Cannot record {type(obj).__name__}")
+
+
+class SessionRecorder:
+    def __init__(self, path: str, chunk_records: int = 32):
+        """
+        Appends frames, detections, commands, IK results and serial traffic
+        to a log file.
+
+        Records are buffered and written in chunks. Each record gets an entry
+        in a fixed-size index file (path + '.idx') so the replayer can
+        memory-map both without parsing the log. Safe to share between threads.
+
+        Args:
+            path: Log file path
+            chunk_records: Records buffered before each write
+        """
+        self.path = path
+        self.chunk_records = chunk_records
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._log = open(path, 'ab')
+        self._idx = open(path + '.idx', 'ab')
+        if new:
+            self._log.write(MAGIC)
+            self._offset = len(MAGIC)
+        else:
+            self._offset = os.path.getsize(path)
+        self._pending: List[bytes] = []
+        self._pending_index: List[Tuple[int, float, int, int]] = []
+        self._lock = threading.RLock()
+
+    def _append(self, record_type: int, payload: bytes, t: Optional[float]):
+        if t is None:
+            t = time.time()
+        header = RECORD_HEADER.pack(record_type, len(payload), t)
+        with self._lock:
+            self._pending.append(header)
+            self._pending.append(payload)
+            self._pending_index.append((record_type, t, self._offset + len(header), len(payload)))
+            self._offset += len(header) + len(payload)
+            if len(self._pending_index) >= self.chunk_records:
+                self.flush()
+
+    def _append_json(self, record_type: int, data, t: Optional[float]):
+        self._append(record_type, json.dumps(data, default=_json_default).encode(), t)
+
+    def frame(self, image: np.ndarray, t: Optional[float] = None):
+        """Record a raw uint8 camera frame (H x W or H x W x C)"""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        channels = image.shape[2] if image.ndim == 3 else 1
+        header = FRAME_HEADER.pack(image.shape[0], image.shape[1], channels)
+        self._append(FRAME, header + image.tobytes(), t)
+
+    def detection(self, detections: Dict, t: Optional[float] = None):
+        """Record detections, e.g. {'red': (x, y), ...} in mm"""
+        self._append_json(DETECTION, detections, t)
+
+    def command(self, command, t: Optional[float] = None):
+        """Record a resolved command (not_slop.Command, dict or string)"""
+        self._append_json(COMMAND, command, t)
+
+    def ik(self, result: Optional[Dict], t: Optional[float] = None):
+        """Record an IK2 result dict (or None for a failed solve)"""
+        self._append_json(IK, result, t)
+
+    def serial(self, data: bytes, direction: str = 'tx', t: Optional[float] = None):
+        """Record raw serial bytes, direction 'tx' or 'rx'"""
+        self._append(SERIAL_TX if direction == 'tx' else SERIAL_RX, bytes(data), t)
+
+    def event(self, data: Dict, t: Optional[float] = None):
+        self._append_json(EVENT, data, t)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_index:
+                return
+            self._log.write(b''.join(self._pending))
+            self._log.flush()
+            # Index entries only go out once their payload is on disk
+            index = np.array(self._pending_index, dtype=INDEX_DTYPE)
+            self._idx.write(index.tobytes())
+            self._idx.flush()
+            self._pending = []
+            self._pending_index = []
+
+    def close(self):
+        self.flush()
+        self._log.close()
+        self._idx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SessionReplayer:
+    def __init__(self, path: str):
+        """
+        Read-only view of a recorded session.
+
+        The log and its index are memory-mapped; frames are returned as
+        array views into the log without copying.
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a session log")
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        index_path = path + '.idx'
+        # Ignore a partly written entry at the end (e.g. after a crash)
+        entries = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        if entries:
+            self.index = np.memmap(index_path, dtype=INDEX_DTYPE, mode='r', shape=(entries,))
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _payload(self, i: int) -> np.ndarray:
+        entry = self.index[i]
+        start = int(entry['offset'])
+        return self.data[start:start + int(entry['length'])]
+
+    def get(self, i: int):
+        """
+        Decode record i.
+
+        Returns:
+            (type, time, value): value is an image array for frames, bytes for
+            serial traffic and the decoded JSON otherwise
+        """
+        entry = self.index[i]
+        record_type = int(entry['type'])
+        payload = self._payload(i)
+        if record_type == FRAME:
+            height, width, channels = FRAME_HEADER.unpack(payload[:FRAME_HEADER.size].tobytes())
+            pixels = payload[FRAME_HEADER.size:]
+            shape = (height, width, channels) if channels > 1 else (height, width)
+            value = pixels.reshape(shape)
+        elif record_type in (SERIAL_TX, SERIAL_RX):
+            value = payload.tobytes()
+        else:
+            value = json.loads(payload.tobytes())
+        return record_type, float(entry['time']), value
+
+    def records(self, record_type: Optional[int] = None) -> Iterator[Tuple[int, float, object]]:
+        """Iterate over (type, time, value), optionally only of one type"""
+        if record_type is None:
+            indices = range(len(self.index))
+        else:
+            indices = np.flatnonzero(self.index['type'] == record_type)
+        for i in indices:
+            yield self.get(int(i))
+
+    def frames(self) -> Iterator[Tuple[float, np.ndarray]]:
+        for _, t, image in self.records(FRAME):
+            yield t, image
+
+    def counts(self) -> Dict[str, int]:
+        types, counts = np.unique(self.index['type'], return_counts=True)
+        return {RECORD_NAMES.get(int(t), str(t)): int(c) for t, c in zip(types, counts)}
+
+
+def replay_pipeline(replayer: SessionReplayer,
+                    arm=None,
+                    colors=('red', 'green', 'blue'),
+                    on_result: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Feed every recorded frame through undistort, rectify, detect and IK as
+    fast as possible.
+
+    Args:
+        replayer: Session to replay
+        arm: IK2.RobotArmIK (defaults to one loaded from params.json)
+        colors: Box colors to detect
+        on_result: Called with the result dict of each frame
+
+    Returns:
+        Dictionary with per-stage timing statistics (ms) and counts
+    """
+    import apriltag_homography
+    import camera_disp_undistort
+    import detect_color
+    import IK2
+
+    if arm is None:
+        arm = IK2.RobotArmIK()
+        arm.load_config('params.json')
+    detector = apriltag_homography.make_detector()
+    board = apriltag_homography.TagBoard.load()
+    new_K = camera_disp_undistort.new_camera_matrix()
+
+    stages = ('undistort', 'rectify', 'detect', 'ik')
+    timings = {stage: [] for stage in stages}
+    frames = 0
+    rectify_failures = 0
+    for t, image in replayer.frames():
+        frames += 1
+        result = {'time': t, 'detections': {}, 'ik': {}}
+
+        start = time.perf_counter()
+        undistorted = camera_disp_undistort.undistort_frame(np.asarray(image), new_K)
+        timings['undistort'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        rectified = apriltag_homography.rectify(undistorted, detector, board=board)
+        timings['rectify'].append(time.perf_counter() - start)
+        if rectified is None:
+            rectify_failures += 1
+            if on_result:
+                on_result(result)
+            continue
+
+        start = time.perf_counter()
+        for color in colors:
+            bbox = detect_color.detect_box(rectified, color)
+            if bbox is not None:
+                x, y, w, h = bbox
+                result['detections'][color] = ((x + w / 2) * detect_color.PX_TO_MM,
+                                               (y + h / 2) * detect_color.PX_TO_MM)
+        timings['detect'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for color, (x, y) in result['detections'].items():
+            result['ik'][color] = arm.inverse_kinematics_relaxed(*arm.table_to_arm(x, y), 0)
+        timings['ik'].append(time.perf_counter() - start)
+
+        if on_result:
+            on_result(result)
+
+    summary = {'frames': frames, 'rectify_failures': rectify_failures}
+    for stage, values in timings.items():
+        if values:
+            ms = np.array(values) * 1000.0
+            summary[stage] = {'mean_ms': float(ms.mean()),
+                              'p95_ms': float(np.percentile(ms, 95)),
+                              'max_ms': float(ms.max())}
+    return summary
+
+
+if __name__ == '__main__':
+    import sys
+
+    for p in sys.argv[1:]:
+        replayer = SessionReplayer(p)
+        print(f"{p}: {replayer.counts()}")
+        print(replay_pipeline(replayer))
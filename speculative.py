@@ -0,0 +1,173 @@
+import re
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import pick_executor
+
+# Words a transcript may use for each box (including common mis-hearings)
+COLOR_WORDS = {
+    'red': ('red',),
+    'green': ('green',),
+    'blue': ('blue', 'blew'),
+}
+VERTICAL_WORDS = {
+    'upper': ('upper', 'top'),
+    'lower': ('lower', 'bottom'),
+}
+HORIZONTAL_WORDS = ('left', 'right')
+NEGATIONS = ('not', "don't", 'dont', 'instead', 'no')
+
+
+def _words(text: str):
+    return re.findall(r"[a-z']+", text.lower())
+
+
+def local_parse(text: str) -> Dict:
+    """
+    Keyword guess at a command, for acting before the model answers.
+
+    Returns:
+        Dictionary with 'color' (or None) and 'color_confidence',
+        'destination' (a not_slop Destination or None) and
+        'destination_confidence', both between 0 and 1
+    """
+    words = _words(text)
+    colors = [color for color, names in COLOR_WORDS.items() if any(w in names for w in words)]
+    vertical = [v for v, names in VERTICAL_WORDS.items() if any(w in names for w in words)]
+    horizontal = [h for h in HORIZONTAL_WORDS if h in words]
+    # A negation means the sentence may be excluding what it names
+    doubt = 0.5 if any(w in NEGATIONS for w in words) else 1.0
+
+    result = {'color': None, 'color_confidence': 0.0, 'destination': None, 'destination_confidence': 0.0}
+    if colors:
+        result['color'] = colors[0]
+        result['color_confidence'] = 0.9 * doubt / len(colors)
+    if vertical and horizontal:
+        result['destination'] = f"{vertical[0]} {horizontal[0]} corner"
+        result['destination_confidence'] = 0.9 * doubt / (len(vertical) * len(horizontal))
+    return result
+
+
+class Speculator:
+    def __init__(self,
+                 executor: pick_executor.PickExecutor,
+                 tracker,
+                 telemetry=None,
+                 min_confidence: float = 0.8,
+                 stop_time: float = 0.2,
+                 timeout: float = 15.0):
+        """
+        Moves the arm over the box a command probably refers to while the
+        real command is still being resolved.
+
+        begin() starts a move to the hover pose above the guessed box from
+        the tracker's cached position; resolve() is called with the final
+        command's colors and either keeps the move (the pick continues from
+        there) or cancels it, easing the arm to a stop.
+
+        Args:
+            executor: PickExecutor moving the arm
+            tracker: BoxTracker with the box positions
+            telemetry: TelemetryReader, to know where a cancelled move stopped
+            min_confidence: Smallest local_parse confidence acted on
+            stop_time: Time to ease to a stop when cancelling (s)
+            timeout: A guess never resolved is cancelled after this long (s)
+        """
+        self.executor = executor
+        self.tracker = tracker
+        self.telemetry = telemetry
+        self.min_confidence = min_confidence
+        self.stop_time = stop_time
+        self.timeout = timeout
+        self.color = None           # box the arm is moving to, if any
+        self.position = None        # its tracked position (mm) before the arm covered it
+        self.hit = None             # (color, position) of the last hit
+        self.started = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def begin(self, text: str) -> Optional[str]:
+        """
+        Start moving toward the box named in a (partial) transcript.
+
+        Returns:
+            The color being moved to, or None if the text was not confident
+            enough, the box isn't tracked or the move isn't possible
+        """
+        guess = local_parse(text)
+        color = guess['color']
+        if color is None or guess['color_confidence'] < self.min_confidence:
+            return None
+        with self._lock:
+            if color == self.color:
+                return color
+            position = self.tracker.get(color)
+            if position is None:
+                return None
+            if self.color is not None:
+                # Changed its mind: stop the old move first
+                self._cancel()
+                self.color = None
+            hover = self.executor.hover_pose(position, self.executor.servo_angles)
+            if hover is None:
+                return None
+            # The pick is verified against a frame without the arm over the box
+            self.executor.capture_reference(color)
+            if not self.executor.run([(hover, pick_executor.GRIPPER_OPEN)], wait=False):
+                self.executor.reference = None
+                return None
+            self.color = color
+            self.position = position
+            self.started = time.monotonic()
+            return color
+
+    def resolve(self, colors: Iterable[str]) -> str:
+        """
+        Settle the guess once the final command(s) are known.
+
+        Args:
+            colors: Box colors of the final commands (empty if there are none)
+
+        Returns:
+            'hit' if the arm was already moving to one of them (self.hit then
+            holds the color and the position to plan with, since the gripper
+            now hides the box from the tracker), 'miss' if the move was
+            cancelled, 'none' if nothing was speculated
+        """
+        with self._lock:
+            self.hit = None
+            if self.color is None:
+                return 'none'
+            if self.color in set(colors):
+                self.hits += 1
+                self.hit = (self.color, self.position)
+                result = 'hit'
+            else:
+                self._cancel()
+                self.misses += 1
+                result = 'miss'
+            self.color = None
+            return result
+
+    def expire(self) -> bool:
+        """Cancel a guess older than timeout. Returns True if one was cancelled"""
+        if self.color is not None and time.monotonic() - self.started > self.timeout:
+            return self.resolve(()) == 'miss'
+        return False
+
+    def _cancel(self):
+        self.executor.cancel(self.stop_time, self.telemetry)
+
+    def stats(self) -> Dict:
+        return {'active': self.color, 'hits': self.hits, 'misses': self.misses}
+
+
+# Example usage
+if __name__ == "__main__":
+    for text in ("move the red box to the upper left",
+                 "put blue in the bottom right corner",
+                 "not the red one, the green one",
+                 "move the box"):
+        print(f"{text!r}: {local_parse(text)}")
@@ -0,0 +1,267 @@
+import struct
+import threading
+import time
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+import trajectory_serial
+
+# Layout of the firmware's telemetry payload (send_telemetry in main.cpp)
+TELEMETRY_FORMAT = '<IHHH5HBBBHHI'
+TELEMETRY_SIZE = struct.calcsize(TELEMETRY_FORMAT)
+
+# Segment start event (send_start_events in main.cpp): seq, micros()
+START_FORMAT = '<BI'
+START_SIZE = struct.calcsize(START_FORMAT)
+
+# Segments never reported as started are forgotten after this long (s)
+SENT_TIMEOUT = 10.0
+
+# Largest relative clock drift allowed between the Teensy and the host
+CLOCK_DRIFT = 1e-4
+
+TELEMETRY_DTYPE = np.dtype([
+    ('host_time', 'f8'),        # time.monotonic() when the frame was parsed
+    ('device_us', 'u4'),        # micros() on the Teensy
+    ('loop_max_us', 'u2'),      # slowest loop() iteration since the last report
+    ('loop_avg_us', 'u2'),
+    ('isr_max_us', 'u2'),       # slowest interpolation interrupt
+    ('setpoints_us', 'u2', (trajectory_serial.NUM_SERVOS,)),
+    ('queue_depth', 'u1'),
+    ('active_seq', 'u1'),       # segment being interpolated
+    ('received_seq', 'u1'),     # last segment queued
+    ('parse_errors', 'u2'),
+    ('dropped', 'u2'),          # segments rejected with a full queue
+    ('segments_rx', 'u4'),
+])
+
+
+def us_to_angle(us):
+    """Servo angle (0-199) from a pulse width, inverse of remapf in main.cpp"""
+    return (np.asarray(us, dtype=float) - 1500.0) * 199.0 / 400.0
+
+
+def decode_telemetry(payload: bytes, host_time: float) -> Optional[np.void]:
+    """Decode one telemetry payload into a TELEMETRY_DTYPE record"""
+    if len(payload) != TELEMETRY_SIZE:
+        return None
+    values = struct.unpack(TELEMETRY_FORMAT, payload)
+    record = np.zeros((), dtype=TELEMETRY_DTYPE)
+    record['host_time'] = host_time
+    record['device_us'] = values[0]
+    record['loop_max_us'] = values[1]
+    record['loop_avg_us'] = values[2]
+    record['isr_max_us'] = values[3]
+    record['setpoints_us'] = values[4:9]
+    record['queue_depth'] = values[9]
+    record['active_seq'] = values[10]
+    record['received_seq'] = values[11]
+    record['parse_errors'] = values[12]
+    record['dropped'] = values[13]
+    record['segments_rx'] = values[14]
+    return record
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, dtype):
+        """Fixed-size buffer keeping the newest capacity records"""
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.index = 0      # next slot to write
+        self.count = 0
+
+    def append(self, record):
+        self.data[self.index] = record
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self, n: Optional[int] = None) -> np.ndarray:
+        """Copy of the newest n records (all if None), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        idx = (self.index - n + np.arange(n)) % self.capacity
+        return self.data[idx]
+
+    def clear(self):
+        self.index = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+
+class TelemetryReader:
+    def __init__(self, link: trajectory_serial.TrajectoryLink, capacity: int = 4096):
+        """
+        Collects the firmware's telemetry frames into ring buffers.
+
+        Actuation latency is measured per segment, from when the host sent it
+        to when the firmware started interpolating it. The firmware reports
+        the start in micros(), which is mapped to host time with the clock
+        offset of the least delayed telemetry frame, so serial transfer and
+        the telemetry period don't add to it.
+
+        Args:
+            link: TrajectoryLink the frames arrive on
+            capacity: Number of telemetry records (and latencies) kept
+        """
+        self.link = link
+        self.records = RingBuffer(capacity, TELEMETRY_DTYPE)
+        self.latencies = RingBuffer(capacity, np.float64)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._clock = None          # (device_us, host_time) of the least delayed frame
+        self._counts_base = None    # (link.segments_sent, segments_rx) when counting started
+        self._last_rx = 0
+        link.handlers[trajectory_serial.FRAME_TELEMETRY] = self._on_frame
+        link.handlers[trajectory_serial.FRAME_START] = self._on_start
+
+    def device_time(self, device_us: int) -> Optional[float]:
+        """time.monotonic() at which the Teensy's micros() read device_us, or None before any telemetry"""
+        if self._clock is None:
+            return None
+        ref_us, ref_time = self._clock
+        # Signed difference, so micros() wrapping around is handled
+        delta = ((int(device_us) - ref_us + (1 << 31)) % (1 << 32)) - (1 << 31)
+        return ref_time + delta * 1e-6
+
+    def _sync_clock(self, device_us: int, host_time: float):
+        """Keep the frame that arrived soonest after it was sent as the clock reference"""
+        predicted = self.device_time(device_us)
+        if predicted is None:
+            self._clock = (device_us, host_time)
+            return
+        # The reference gets less trustworthy as the clocks drift apart
+        allowance = CLOCK_DRIFT * abs(host_time - self._clock[1])
+        if host_time - predicted < allowance:
+            self._clock = (device_us, host_time)
+
+    def _on_frame(self, payload: bytes):
+        now = time.monotonic()
+        record = decode_telemetry(payload, now)
+        if record is None:
+            return
+        with self._lock:
+            self.records.append(record)
+            self._sync_clock(int(record['device_us']), now)
+            rx = int(record['segments_rx'])
+            if self._counts_base is None or rx < self._last_rx:
+                # First report, or the Teensy was reset: count losses from here
+                self._counts_base = (self.link.segments_sent, rx)
+            self._last_rx = rx
+
+    def _on_start(self, payload: bytes):
+        if len(payload) != START_SIZE:
+            return
+        seq, device_us = struct.unpack(START_FORMAT, payload)
+        now = time.monotonic()
+        with self._lock:
+            sent = self.link.sent_times.pop(seq, None)
+            started = self.device_time(device_us)
+            if sent is not None and started is not None:
+                self.latencies.append(started - sent)
+            # Segments whose start was lost would otherwise stay forever
+            for stale, t in list(self.link.sent_times.items()):
+                if now - t > SENT_TIMEOUT:
+                    self.link.sent_times.pop(stale, None)
+
+    def start(self, poll_period: float = 0.005):
+        """Poll the serial link in a background thread"""
+        if self._thread is not None:
+            return
+        self._running = True
+
+        def run():
+            while self._running:
+                self.link.poll()
+                time.sleep(poll_period)
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def latest(self, n: Optional[int] = None) -> np.ndarray:
+        with self._lock:
+            return self.records.latest(n)
+
+    def servo_angles(self, after: Optional[float] = None, timeout: float = 0.2) -> Optional[Tuple[Dict, float]]:
+        """
+        Pose the firmware is commanding, from the newest report.
+
+        Args:
+            after: Only use a report received after this time.monotonic()
+            timeout: Give up waiting for such a report after this long (s)
+
+        Returns:
+            (servo_angles dict like IK2's, gripper angle), or None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            records = self.latest(1)
+            if len(records) and (after is None or records[0]['host_time'] > after):
+                break
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.005)
+        angles = us_to_angle(records[0]['setpoints_us'])
+        channels = trajectory_serial.SERVO_CHANNELS
+        servo = {joint: float(angles[channel]) for joint, channel in channels.items() if joint != 'gripper'}
+        return servo, float(angles[channels['gripper']])
+
+    def summary(self, window: Optional[int] = None) -> Dict:
+        """
+        Summary statistics over the newest window records (all if None).
+
+        Returns:
+            Dictionary with loop/interrupt timing, queue depth, actuation
+            latency (s), error counters and 'missing', the number of segments
+            sent since the first report (or the last firmware reset) that the
+            firmware never received
+        """
+        with self._lock:
+            records = self.records.latest(window)
+            latencies = self.latencies.latest(window)
+            counts_base = self._counts_base
+        if len(records) == 0:
+            return {'records': 0}
+
+        last = records[-1]
+        span = records['host_time'][-1] - records['host_time'][0]
+        result = {
+            'records': len(records),
+            'rate_hz': float((len(records) - 1) / span) if span > 0 else 0.0,
+            'loop_avg_us': float(np.mean(records['loop_avg_us'])),
+            'loop_max_us': int(np.max(records['loop_max_us'])),
+            'isr_max_us': int(np.max(records['isr_max_us'])),
+            'queue_depth_mean': float(np.mean(records['queue_depth'])),
+            'queue_depth_max': int(np.max(records['queue_depth'])),
+            'parse_errors': int(last['parse_errors']),
+            'dropped': int(last['dropped']),
+            'missing': max(0, (self.link.segments_sent - counts_base[0])
+                           - (int(last['segments_rx']) - counts_base[1])),
+            'host_frame_errors': self.link.parser.errors,
+            'setpoints_us': last['setpoints_us'].tolist()
+        }
+        if len(latencies):
+            result['latency_mean'] = float(np.mean(latencies))
+            result['latency_p95'] = float(np.percentile(latencies, 95))
+            result['latency_max'] = float(np.max(latencies))
+        return result
+
+
+# Example usage
+if __name__ == "__main__":
+    link = trajectory_serial.TrajectoryLink()
+    reader = TelemetryReader(link)
+    reader.start()
+    try:
+        while True:
+            time.sleep(1)
+            print(reader.summary(window=20))
+    except KeyboardInterrupt:
+        reader.stop()
@@ -0,0 +1,40 @@
+import numpy as np
+
+import box_tracker
+
+
+def frames():
+    seen = np.zeros((400, 500, 3), dtype=np.uint8)
+    seen[100:160, 100:160] = (150, 150, 245)    # inside COLOR_RANGES['red']
+    return seen, np.zeros_like(seen)
+
+
+def test_track_kept_until_lost_after():
+    seen, hidden = frames()
+    tracker = box_tracker.BoxTracker(colors=('red',), lost_after=1.0)
+    t = 0.0
+    for _ in range(5):
+        tracker.update(seen, t)
+        t += 1 / 30
+    # Half a second hidden (e.g. by the arm) keeps the track
+    for _ in range(15):
+        tracker.update(hidden, t)
+        t += 1 / 30
+    assert tracker.get('red', t) is not None
+    assert 0 < tracker.confidence('red') < 1
+    for _ in range(20):
+        tracker.update(hidden, t)
+        t += 1 / 30
+    assert tracker.get('red', t) is None
+
+
+def test_confidence_decay_independent_of_frame_rate():
+    seen, hidden = frames()
+    confidences = []
+    for fps in (10, 60):
+        tracker = box_tracker.BoxTracker(colors=('red',))
+        tracker.update(seen, 0.0)
+        for i in range(1, fps // 2 + 1):
+            tracker.update(hidden, i / fps)
+        confidences.append(tracker.confidence('red'))
+    assert np.isclose(confidences[0], confidences[1])
@@ -0,0 +1,53 @@
+import numpy as np
+
+import IK2
+import collision_check
+
+
+def brute_force_distance(p1, q1, p2, q2, samples=1001):
+    s = np.linspace(0.0, 1.0, samples)[:, None]
+    a = p1 + s * (q1 - p1)
+    b = p2 + s * (q2 - p2)
+    return np.min(np.linalg.norm(a[:, None] - b[None], axis=-1))
+
+
+def test_point_on_segment_middle():
+    d = collision_check.segment_distance(np.array([0.0, 0, 0]), np.array([100.0, 0, 0]),
+                                         np.array([50.0, 5, 0]), np.array([50.0, 5, 0]))
+    assert np.isclose(d, 5.0)
+
+
+def test_sphere_obstacles_match_brute_force():
+    rng = np.random.default_rng(0)
+    p1 = rng.uniform(-100, 100, (200, 3))
+    q1 = rng.uniform(-100, 100, (200, 3))
+    centers = rng.uniform(-100, 100, (200, 3))
+    d = collision_check.segment_distance(p1, q1, centers, centers)
+    # Exact point-segment distance
+    seg = q1 - p1
+    t = np.clip(np.sum((centers - p1) * seg, axis=1) / np.sum(seg * seg, axis=1), 0, 1)
+    expected = np.linalg.norm(p1 + t[:, None] * seg - centers, axis=1)
+    assert np.allclose(d, expected)
+    # Degenerate first segment too
+    d = collision_check.segment_distance(centers, centers, p1, q1)
+    assert np.allclose(d, expected)
+
+
+def test_segments_match_brute_force():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        p1, q1, p2, q2 = rng.uniform(-100, 100, (4, 3))
+        d = collision_check.segment_distance(p1, q1, p2, q2)
+        assert d <= brute_force_distance(p1, q1, p2, q2) + 1e-6
+        assert d >= brute_force_distance(p1, q1, p2, q2) - 0.5
+
+
+def test_sphere_on_link_collides():
+    arm = IK2.RobotArmIK()
+    checker = collision_check.CollisionChecker(arm)
+    angles = np.array([[0.0, 60.0, -60.0, -60.0]])
+    points = arm.forward_kinematics_batch(angles)[0]
+    middle = (points[1] + points[2]) / 2
+    assert checker.check(angles)['obstacles'][0]
+    checker.add_capsule(middle, middle, 5.0)
+    assert not checker.check(angles)['obstacles'][0]
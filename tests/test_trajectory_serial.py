@@ -0,0 +1,35 @@
+import numpy as np
+
+import trajectory_serial
+
+
+def test_samples_end_at_each_waypoint():
+    waypoints = np.array([[0, 0, 0, 0, 0], [10, 20, 30, 40, 50], [0, 40, 10, 40, 60]], dtype=float)
+    times = np.array([0.0, 0.5, 1.5])
+    segments = trajectory_serial.hermite_segments(waypoints, times)
+    samples = trajectory_serial.sample_segments(waypoints[0], segments, 10)
+    assert samples.shape == (20, trajectory_serial.NUM_SERVOS)
+    assert np.allclose(samples[9], waypoints[1])
+    assert np.allclose(samples[-1], waypoints[2])
+
+
+def test_stops_follow_straight_joint_moves():
+    # Out to a point and back: Catmull-Rom velocities overshoot it
+    waypoints = np.array([[0, 0, 0, 0, 0], [0, 90, 0, 0, 0], [0, 100, 0, 0, 0], [0, 0, 0, 0, 0]], dtype=float)
+    times = np.array([0.0, 0.5, 1.0, 1.5])
+    overshoot = trajectory_serial.sample_segments(
+        waypoints[0], trajectory_serial.hermite_segments(waypoints, times), 50)
+    assert overshoot[:, 1].max() > 100
+
+    segments = trajectory_serial.hermite_segments(waypoints, times, stops=range(len(times)))
+    assert all(np.all(vel == 0) for _, _, vel in segments)
+    samples = trajectory_serial.sample_segments(waypoints[0], segments, 50)
+    assert samples[:, 1].max() <= 100 + 1e-9
+
+
+def test_servo_vector_uses_firmware_channels():
+    servo = {'joint1': 1.0, 'joint2': 2.0, 'joint3': 3.0, 'joint4': 4.0}
+    vector = trajectory_serial.servo_vector(servo, 5.0)
+    for joint, angle in servo.items():
+        assert vector[trajectory_serial.SERVO_CHANNELS[joint]] == angle
+    assert vector[trajectory_serial.SERVO_CHANNELS['gripper']] == 5.0
@@ -0,0 +1,341 @@
+import struct
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+# Must match 85water_teensy/src/main.cpp
+FRAME_SYNC = 0xA5
+FRAME_SEGMENT = ord('S')
+FRAME_QUEUE = ord('Q')
+FRAME_TELEMETRY = ord('T')
+FRAME_CANCEL = ord('C')
+FRAME_START = ord('B')
+MAX_PAYLOAD = 32
+NUM_SERVOS = 5
+QUEUE_SIZE = 16
+ANGLE_SCALE = 100.0     # segment angles/velocities are sent in hundredths
+MAX_DURATION = 65.535   # seconds, duration is sent as u16 milliseconds
+
+# Firmware servo number of each joint (servo 4 is the gripper)
+SERVO_CHANNELS = {
+    'joint1': 0,
+    'joint2': 1,
+    'joint3': 2,
+    'joint4': 3,
+    'gripper': 4
+}
+
+
+def checksum(data: bytes) -> int:
+    """XOR of all bytes"""
+    value = 0
+    for b in data:
+        value ^= b
+    return value
+
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    """SYNC, type, length, payload, checksum"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload too long: {len(payload)} bytes")
+    body = bytes([frame_type, len(payload)]) + payload
+    return bytes([FRAME_SYNC]) + body + bytes([checksum(body)])
+
+
+def encode_segment(seq: int, duration: float, end_angles, end_velocities) -> bytes:
+    """
+    Encode one trajectory segment.
+
+    The firmware interpolates a cubic from where the previous segment ended
+    to the given end angles and velocities.
+
+    Args:
+        seq: Sequence number (0-255), echoed back in queue reports
+        duration: Segment duration in seconds
+        end_angles: NUM_SERVOS servo angles (0-199) at the end of the segment
+        end_velocities: NUM_SERVOS servo velocities (angle/s) at the end of the segment
+
+    Returns:
+        Frame bytes ready to write to the serial port
+    """
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"Segment duration must be in (0, {MAX_DURATION}] s, got {duration}")
+    pos = np.round(np.asarray(end_angles, dtype=float) * ANGLE_SCALE)
+    vel = np.round(np.asarray(end_velocities, dtype=float) * ANGLE_SCALE)
+    if pos.shape != (NUM_SERVOS,) or vel.shape != (NUM_SERVOS,):
+        raise ValueError(f"Expected {NUM_SERVOS} angles and velocities")
+    vel = np.clip(vel, -32768, 32767)
+
+    payload = struct.pack('<BH', seq & 0xFF, int(round(duration * 1000)))
+    for p, v in zip(pos, vel):
+        payload += struct.pack('<hh', int(p), int(v))
+    return encode_frame(FRAME_SEGMENT, payload)
+
+
+def hermite_segments(waypoints, times, end_velocity_zero: bool = True,
+                     stops=()) -> List[Tuple[float, np.ndarray, np.ndarray]]:
+    """
+    Turn timed waypoints into segments with Catmull-Rom velocities.
+
+    Args:
+        waypoints: Array of shape (N, NUM_SERVOS) of servo angles; the first
+                   row is the current pose
+        times: Array of shape (N,) of increasing times in seconds
+        end_velocity_zero: Stop at the last waypoint
+        stops: Indices of waypoints the arm comes to rest at, e.g. to grip
+
+    Returns:
+        List of N-1 (duration, end_angles, end_velocities)
+    """
+    waypoints = np.asarray(waypoints, dtype=float)
+    times = np.asarray(times, dtype=float)
+    if len(waypoints) != len(times) or len(times) < 2:
+        raise ValueError("Need matching waypoints and times, at least two of each")
+
+    velocities = np.zeros_like(waypoints)
+    if len(times) > 2:
+        velocities[1:-1] = (waypoints[2:] - waypoints[:-2]) / (times[2:] - times[:-2])[:, None]
+    if not end_velocity_zero:
+        velocities[-1] = (waypoints[-1] - waypoints[-2]) / (times[-1] - times[-2])
+    velocities[list(stops)] = 0.0
+
+    durations = np.diff(times)
+    return [(float(durations[i]), waypoints[i + 1], velocities[i + 1]) for i in range(len(durations))]
+
+
+def sample_segments(start, segments, samples_per_segment: int = 20, start_velocity=None) -> np.ndarray:
+    """
+    Positions the firmware passes through (run_interpolation in main.cpp).
+
+    Args:
+        start: NUM_SERVOS angles the first segment starts from
+        segments: (duration, end_angles, end_velocities) as from hermite_segments
+        samples_per_segment: Samples per segment, the last one at its end
+        start_velocity: Velocities at start, zero (at rest) if None
+
+    Returns:
+        Array of shape (len(segments) * samples_per_segment, NUM_SERVOS)
+    """
+    s = np.arange(1, samples_per_segment + 1)[:, None] / samples_per_segment
+    h00, h10 = 2 * s ** 3 - 3 * s ** 2 + 1, s ** 3 - 2 * s ** 2 + s
+    h01, h11 = -2 * s ** 3 + 3 * s ** 2, s ** 3 - s ** 2
+    pos = np.asarray(start, dtype=float)
+    vel = np.zeros_like(pos) if start_velocity is None else np.asarray(start_velocity, dtype=float)
+    samples = []
+    for duration, end_pos, end_vel in segments:
+        samples.append(h00 * pos + h10 * duration * vel + h01 * end_pos + h11 * duration * end_vel)
+        pos, vel = np.asarray(end_pos, dtype=float), np.asarray(end_vel, dtype=float)
+    return np.concatenate(samples) if samples else np.zeros((0, len(pos)))
+
+
+def servo_vector(servo_angles: Dict, gripper: float) -> np.ndarray:
+    """NUM_SERVOS array in firmware order from an IK2 servo_angles dict"""
+    vector = np.zeros(NUM_SERVOS)
+    for joint, angle in servo_angles.items():
+        vector[SERVO_CHANNELS[joint]] = angle
+    vector[SERVO_CHANNELS['gripper']] = gripper
+    return vector
+
+
+class FrameParser:
+    """Incremental parser for frames coming back from the firmware"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data: bytes) -> List[Tuple[int, bytes]]:
+        """
+        Add received bytes.
+
+        Returns:
+            List of complete (frame_type, payload) frames
+        """
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(bytes([FRAME_SYNC]))
+            if start < 0:
+                # Anything else is text output (e.g. debug prints)
+                self.buffer.clear()
+                break
+            del self.buffer[:start]
+            if len(self.buffer) < 3:
+                break
+            length = self.buffer[2]
+            if length > MAX_PAYLOAD:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            if len(self.buffer) < 4 + length:
+                break
+            body = bytes(self.buffer[1:3 + length])
+            if checksum(body) != self.buffer[3 + length]:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            frames.append((body[0], body[2:]))
+            del self.buffer[:4 + length]
+        return frames
+
+
+class TrajectoryLink:
+    def __init__(self, ser=None, recorder=None):
+        """
+        Streams trajectory segments to the Teensy with queue flow control.
+
+        The firmware starts each segment from where the previous one (or the
+        last legacy command) left each servo, so the first waypoint sent
+        should be the arm's current pose.
+
+        Args:
+            ser: Open serial.Serial; defaults to command_serial.ser
+            recorder: session_log.SessionRecorder the raw traffic is logged to, or None
+        """
+        if ser is None:
+            import command_serial
+            ser = command_serial.ser
+        self.ser = ser
+        self.recorder = recorder
+        self.parser = FrameParser()
+        self.seq = 0
+        self.queue_depth = 0
+        self.queue_size = QUEUE_SIZE
+        self.last_seq = None
+        self.handlers = {}
+        self.segments_sent = 0
+        self.sent_times = {}        # seq -> time.monotonic() when sent
+        self._lock = threading.Lock()
+
+    def _write(self, data: bytes):
+        self.ser.write(data)
+        if self.recorder:
+            self.recorder.serial(data, 'tx')
+
+    def poll(self) -> List[Tuple[int, bytes]]:
+        """
+        Read whatever the firmware has sent and update the queue state.
+
+        Frames other than queue reports are passed to the handler registered
+        for their type in self.handlers and returned.
+        """
+        with self._lock:
+            waiting = self.ser.in_waiting
+            if not waiting:
+                return []
+            data = self.ser.read(waiting)
+            if self.recorder:
+                self.recorder.serial(data, 'rx')
+            frames = self.parser.feed(data)
+        others = []
+        for frame_type, payload in frames:
+            if frame_type == FRAME_QUEUE and len(payload) == 3:
+                self.queue_depth, self.queue_size, self.last_seq = payload
+            else:
+                handler = self.handlers.get(frame_type)
+                if handler is not None:
+                    handler(payload)
+                others.append((frame_type, payload))
+        return others
+
+    def request_queue_depth(self, timeout: float = 0.1) -> int:
+        """Ask the firmware for its queue depth and wait for the answer"""
+        self._write(encode_frame(FRAME_QUEUE, b''))
+        previous = self.last_seq
+        deadline = time.monotonic() + timeout
+        self.last_seq = None
+        while self.last_seq is None and time.monotonic() < deadline:
+            self.poll()
+            time.sleep(0.001)
+        if self.last_seq is None:
+            self.last_seq = previous
+        return self.queue_depth
+
+    def send_segment(self, duration: float, end_angles, end_velocities) -> int:
+        """Send one segment without flow control. Returns its sequence number"""
+        seq = self.seq
+        self._write(encode_segment(seq, duration, end_angles, end_velocities))
+        self.sent_times[seq] = time.monotonic()
+        self.segments_sent += 1
+        self.seq = (self.seq + 1) & 0xFF
+        # Count it as queued until the firmware reports back
+        self.queue_depth += 1
+        return seq
+
+    def send_trajectory(self, waypoints, times, timeout: float = 10.0, poll_period: float = 0.005) -> bool:
+        """
+        Stream a whole trajectory, keeping the firmware queue from overflowing.
+
+        Args:
+            waypoints: Array of shape (N, NUM_SERVOS) of servo angles, first row = current pose
+            times: Array of shape (N,) of times in seconds
+            timeout: Give up if the queue stays full this long (s)
+            poll_period: Sleep between queue checks (s)
+
+        Returns:
+            True if every segment was sent
+        """
+        return self.send_segments(hermite_segments(waypoints, times), timeout, poll_period)
+
+    def send_segments(self, segments, timeout: float = 10.0, poll_period: float = 0.005) -> bool:
+        """
+        Stream (duration, end_angles, end_velocities) segments like
+        send_trajectory, e.g. from hermite_segments.
+
+        Returns:
+            True if every segment was sent
+        """
+        for duration, pos, vel in segments:
+            deadline = time.monotonic() + timeout
+            self.poll()
+            while self.queue_depth >= self.queue_size:
+                if time.monotonic() > deadline:
+                    print("Trajectory send timed out: firmware queue full")
+                    return False
+                time.sleep(poll_period)
+                self.poll()
+            self.send_segment(duration, pos, vel)
+        return True
+
+    def cancel(self, stop_time: float = 0.2) -> int:
+        """
+        Drop every queued segment. The firmware eases to a stop over stop_time
+        seconds from wherever the arm is (immediately if 0); segments sent
+        afterwards start from there.
+
+        Returns:
+            Sequence number of the stop segment
+        """
+        seq = self.seq
+        ms = int(round(min(max(stop_time, 0.0), MAX_DURATION) * 1000))
+        self._write(encode_frame(FRAME_CANCEL, struct.pack('<BH', seq, ms)))
+        self.sent_times.clear()
+        self.seq = (self.seq + 1) & 0xFF
+        if ms:
+            self.sent_times[seq] = time.monotonic()
+        self.queue_depth = 1 if ms else 0
+        return seq
+
+    def wait_idle(self, timeout: float = 30.0, poll_period: float = 0.05) -> bool:
+        """Wait until the firmware has run every queued segment"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.request_queue_depth() == 0:
+                return True
+            time.sleep(poll_period)
+        return False
+
+
+# Example usage
+if __name__ == "__main__":
+    # Sweep joint2 back and forth over two seconds
+    waypoints = np.array([
+        [90, 90, 100, 180, 0],
+        [90, 120, 100, 180, 0],
+        [90, 60, 100, 180, 0],
+        [90, 90, 100, 180, 0],
+    ], dtype=float)
+    times = np.array([0.0, 0.5, 1.5, 2.0])
+    for duration, pos, vel in hermite_segments(waypoints, times):
+        frame = encode_segment(0, duration, pos, vel)
+        print(f"{duration:.2f}s -> {pos} ({len(frame)} bytes): {frame.hex()}")